@@ -1,17 +1,67 @@
 # app.py
 import os
+import asyncio
+import atexit
+import bisect
+import contextvars
+import logging
 import random # 新增
 import time   # 新增
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+import re
+import json
+import hashlib
+import sqlite3
+import socket
+import struct
+import hmac
+import difflib
+import csv
+import io
+import itertools
+import tempfile
+import threading
+import queue
+import sys
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, fields as dataclass_fields, replace
+from datetime import timedelta
+from enum import IntEnum
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote_plus, urlsplit
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
+from linebot import LineBotApi, WebhookParser
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
+from linebot.models import MessageAction, MessageEvent, QuickReply, QuickReplyButton, TextMessage, TextSendMessage
 
 # --- 引入網路爬蟲相關函式庫 ---
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve
+import kss_catalog
 # -----------------------------
 
+try:
+    import fcntl # 跨 process 的檔案鎖（僅 POSIX）
+except ImportError:
+    fcntl = None
+
+try:
+    import aiohttp # FETCH_BACKEND=aiohttp 時使用
+    from aiohttp.compression_utils import HAS_BROTLI as _AIOHTTP_BROTLI
+except ImportError:
+    aiohttp = None
+    _AIOHTTP_BROTLI = False
+
 app = Flask(__name__)
 
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
@@ -25,7 +75,7 @@ if LINE_CHANNEL_SECRET is None:
     exit(1)
 
 line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+parser = WebhookParser(LINE_CHANNEL_SECRET)
 
 # --- 新增 User-Agent 列表 ---
 USER_AGENTS = [
@@ -37,29 +87,436 @@ USER_AGENTS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.51 Safari/537.36"
 ]
 
+# --- 並行查詢設定 ---
+# 整體查詢的截止時間（秒）：所有廠商同時查詢，時間到了就先回覆已完成的結果
+SEARCH_DEADLINE_SECONDS = float(os.getenv('SEARCH_DEADLINE_SECONDS', '25'))
+# 並行查詢用的執行緒數量（整個 process 共用）
+SEARCH_MAX_WORKERS = int(os.getenv('SEARCH_MAX_WORKERS', '10'))
+
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS, thread_name_prefix='scrape')
+
+# --- 請求頻率限制設定 ---
+# 每個網站（host）一個 token bucket：平均每秒 HOST_RATE 個請求，閒置時最多累積 HOST_BURST 個可以連續發送。
+# 各廠商可以在廠商設定中以 rate/burst 覆寫；HOST_RATE 設為 0 則不限制
+HOST_RATE = float(os.getenv('HOST_RATE', '0.3'))
+HOST_BURST = float(os.getenv('HOST_BURST', '2'))
+# token bucket 的狀態檔目錄，同一台機器上的所有 gunicorn worker 共用額度；設為空字串則只在 process 內共用
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'spider-code-ratelimit'))
+
+# --- HTTP 連線池設定 ---
+# 每個廠商網站共用一個長期存在的 Session，保留 keep-alive 連線，省下每次的 TCP/TLS 握手
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+# 同一個 host 同時進行中的請求數上限
+HOST_MAX_CONCURRENCY = int(os.getenv('HOST_MAX_CONCURRENCY', '4'))
+# 連線失敗或 429/5xx 時的重試次數與退避係數（秒）
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+# 網站回傳 Retry-After 時最多等待的秒數，避免單次查詢被拖太久
+RETRY_AFTER_MAX = float(os.getenv('RETRY_AFTER_MAX', '10'))
+# 下載頁面的方式：requests（每個查詢執行緒各自使用連線池）或 aiohttp（整個 process 的連線
+# 由一個 event loop 執行緒處理，同時進行很多查詢時比較省資源）
+FETCH_BACKEND = os.getenv('FETCH_BACKEND', 'requests')
+if FETCH_BACKEND == 'aiohttp' and aiohttp is None:
+    print('警告：未安裝 aiohttp，FETCH_BACKEND 改用 requests。')
+    FETCH_BACKEND = 'requests'
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 頁面以串流方式下載，解壓縮後超過這個大小就停止下載，只保留前面的部分（結果列都在頁面前段）；
+# 避免異常的大頁面讓 worker 的記憶體暴增。設為 0 則不限制
+MAX_RESPONSE_BYTES = int(os.getenv('MAX_RESPONSE_BYTES', str(2 * 1024 * 1024)))
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+_host_sessions = {}
+_host_semaphores = {}
+_host_labels = {} # host -> 指標標籤（廠商 key）
+_session_lock = threading.Lock()
+
+# --- HTML 解析設定 ---
+# 有安裝 lxml 時使用速度快很多的 lxml，否則退回 Python 內建的 html.parser
+try:
+    import lxml # noqa: F401
+    _DEFAULT_HTML_PARSER = 'lxml'
+except ImportError:
+    _DEFAULT_HTML_PARSER = 'html.parser'
+HTML_PARSER = os.getenv('HTML_PARSER', _DEFAULT_HTML_PARSER)
+
+# --- 背景工作佇列設定 ---
+# webhook 只負責驗證簽名並把事件放進佇列，實際查詢交給背景執行緒處理
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '100'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+# reply token 的有效時間有限，超過這個秒數就改用 push_message
+REPLY_TOKEN_TTL_SECONDS = float(os.getenv('REPLY_TOKEN_TTL_SECONDS', '50'))
+
+class JobStats:
+    """
+    統計背景工作佇列的狀態：佇列長度、等待時間與處理時間，
+    方便依照實際訊息量調整 JOB_WORKERS。
+    """
+    def __init__(self, sample_size=500):
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.replied = 0
+        self.pushed = 0
+        self._wait_samples = deque(maxlen=sample_size)
+        self._duration_samples = deque(maxlen=sample_size)
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_job(self, wait_seconds, duration_seconds, ok):
+        with self._lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._wait_samples.append(wait_seconds)
+            self._duration_samples.append(duration_seconds)
+
+    def snapshot(self, queue_depth):
+        with self._lock:
+            return {
+                "queue_depth": queue_depth,
+                "queue_capacity": JOB_QUEUE_SIZE,
+                "workers": JOB_WORKERS,
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "replied": self.replied,
+                "pushed": self.pushed,
+                "wait_seconds": _summarize(self._wait_samples),
+                "duration_seconds": _summarize(self._duration_samples),
+            }
+
+def _summarize(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[int(len(ordered) * 0.50)], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+job_stats = JobStats()
+
+_job_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_job_workers = []
+_job_workers_lock = threading.Lock()
+
+# --- 查詢結果快取設定 ---
+# 快取最多保留幾筆（廠商 + 料號 為一筆），超過時淘汰最久沒用到的
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', '2000'))
+# 各廠商結果的快取秒數在廠商設定的 cache_ttl 中（價格/庫存變動快的短一點），這是預設值
+DEFAULT_CACHE_TTL = 10 * 60
+# 錯誤結果（反爬蟲、逾時等）只短暫快取，避免重試時一直打同一個正在擋我們的網站
+NEGATIVE_CACHE_TTL = float(os.getenv('NEGATIVE_CACHE_TTL', '60'))
+
+# --- 廠商健康狀態 / 斷路器設定 ---
+# 以最近 HEALTH_WINDOW_SECONDS 秒內的請求計算錯誤率與反爬蟲比例
+HEALTH_WINDOW_SECONDS = float(os.getenv('HEALTH_WINDOW_SECONDS', '300'))
+# 至少要有幾次請求才會判斷是否跳脫
+BREAKER_MIN_REQUESTS = int(os.getenv('BREAKER_MIN_REQUESTS', '5'))
+# 錯誤（含逾時與反爬蟲）比例或反爬蟲比例超過門檻時，暫停查詢該廠商
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_CAPTCHA_RATE = float(os.getenv('BREAKER_CAPTCHA_RATE', '0.3'))
+# 暫停多久之後放一個請求去試探是否恢復
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', '120'))
+# timeout 依最近成功請求的 p95 延遲 x 倍數決定，下限為 ADAPTIVE_TIMEOUT_MIN，上限為廠商設定的 timeout
+ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv('ADAPTIVE_TIMEOUT_FACTOR', '2'))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv('ADAPTIVE_TIMEOUT_MIN', '3'))
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30)
+
+# --- 相同查詢合併（single-flight）設定 ---
+# 同一台機器上的 gunicorn worker 透過這個目錄裡的檔案鎖合併相同的廠商查詢，設為空字串則只在 process 內合併
+SINGLE_FLIGHT_DIR = os.getenv('SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'spider-code-flight'))
+# 其他 worker 剛完成的相同查詢，在這個秒數內可以直接沿用
+SINGLE_FLIGHT_REUSE_SECONDS = float(os.getenv('SINGLE_FLIGHT_REUSE_SECONDS', '5'))
+# 每隔這麼多秒清掉過期的鎖檔與結果檔
+SINGLE_FLIGHT_SWEEP_SECONDS = float(os.getenv('SINGLE_FLIGHT_SWEEP_SECONDS', '60'))
+
+# --- 熱門料件預先查詢設定 ---
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '0') == '1'
+# 固定要保持新鮮的料號清單（一行一個，# 開頭為註解），例如常用 BOM 的料號
+PREFETCH_WATCHLIST_PATH = os.getenv('PREFETCH_WATCHLIST_PATH')
+# 每一輪預先查詢的時間長度（秒），請求會平均分散在這段時間內
+PREFETCH_WINDOW_SECONDS = float(os.getenv('PREFETCH_WINDOW_SECONDS', '3600'))
+# 除了清單之外，再加入最近最常被查詢的前 N 個料號
+PREFETCH_TOP_QUERIES = int(os.getenv('PREFETCH_TOP_QUERIES', '100'))
+# 預先查詢時，同一個廠商兩次請求之間至少間隔幾秒
+PREFETCH_VENDOR_MIN_INTERVAL = float(os.getenv('PREFETCH_VENDOR_MIN_INTERVAL', '10'))
+# 同一台機器上只有拿到這個檔案鎖的 worker 執行預先查詢，其他 worker 定期重試（原本的 worker 結束時接手）；
+# 設為空字串則每個 worker 各自預先查詢
+PREFETCH_LOCK_PATH = os.getenv('PREFETCH_LOCK_PATH', os.path.join(tempfile.gettempdir(), 'spider-code-prefetch.lock'))
+# 查詢次數的半衰期（秒）：越久以前的查詢權重越低
+QUERY_FREQUENCY_HALF_LIFE = float(os.getenv('QUERY_FREQUENCY_HALF_LIFE', str(24 * 60 * 60)))
+
+# --- 價格/庫存歷史資料庫設定 ---
+# SQLite（WAL 模式）資料庫路徑，所有 worker 共用；設為空字串則停用
+PRICE_DB_PATH = os.getenv('PRICE_DB_PATH', 'spider_code.db')
+# 寫入會先放進佇列，由背景執行緒每累積 N 筆或每隔幾秒批次寫入，不佔用回覆時間
+PRICE_STORE_BATCH_SIZE = int(os.getenv('PRICE_STORE_BATCH_SIZE', '100'))
+PRICE_STORE_FLUSH_SECONDS = float(os.getenv('PRICE_STORE_FLUSH_SECONDS', '2'))
+# 查詢結果保留的天數，背景寫入執行緒每小時刪除更舊的紀錄；0 為永久保留
+PRICE_RETENTION_DAYS = float(os.getenv('PRICE_RETENTION_DAYS', '90'))
+
+# --- 料號索引設定 ---
+# 以查詢過且有結果的料號（與結果名稱中的料號）建立索引，查詢前先把使用者輸入的各種寫法對應到同一個料號，
+# 不認得的料號照常查詢，並在第一則回覆先送出相似料號的建議；已知各廠商都查無結果時才只回覆建議
+PART_INDEX_ENABLED = os.getenv('PART_INDEX_ENABLED', '1') == '1'
+# 相似度（0~1）達到這個值才列為建議
+PART_SUGGEST_MIN_SCORE = float(os.getenv('PART_SUGGEST_MIN_SCORE', '0.8'))
+# worker 啟動後由背景執行緒從價格資料庫載入最近的幾筆料號
+PART_INDEX_SEED_LIMIT = int(os.getenv('PART_INDEX_SEED_LIMIT', '50000'))
+
+# --- KSS 型錄設定 ---
+# KSS 沒有搜尋頁，改為擷取 PDF 型錄建立本機索引（kss_catalog.py），查詢時直接讀取索引。
+# 來源可以是網址或本機檔案；背景執行緒每隔一段時間檢查一次，PDF 的 ETag/sha256 沒變就不重建
+KSS_CATALOG_ENABLED = os.getenv('KSS_CATALOG_ENABLED', '1') == '1'
+KSS_CATALOG_SOURCE = os.getenv('KSS_CATALOG_SOURCE', kss_catalog.DEFAULT_SOURCE)
+KSS_CATALOG_INDEX = os.getenv('KSS_CATALOG_INDEX', kss_catalog.DEFAULT_INDEX_PATH)
+KSS_CATALOG_REFRESH_SECONDS = float(os.getenv('KSS_CATALOG_REFRESH_SECONDS', str(24 * 60 * 60)))
+KSS_CATALOG_LINK = "https://www.kss.com.tw/filedown.php?file=catalog.pdf&site=dXBsb2FkL3RlY3Bkb3duLzQ4Ny1DUy5wZGY="
+
+# --- BOM 批次查詢設定 ---
+# /bom 需要以 Authorization: Bearer <BOM_API_TOKEN> 呼叫；未設定時停用這個端點
+BOM_API_TOKEN = os.getenv('BOM_API_TOKEN')
+BOM_MAX_LINES = int(os.getenv('BOM_MAX_LINES', '500'))
+# 同時進行的料號數量（整個 process 共用）。各廠商的請求頻率仍由 fetch_page 的 token bucket 限制，
+# 這個值不宜太大，否則等待額度的時間會超過 SEARCH_DEADLINE_SECONDS，後面的料號只會得到略過的結果
+BOM_CONCURRENCY = int(os.getenv('BOM_CONCURRENCY', '2'))
+# LINE 上的 BOM 查詢每累積幾個料號推送一次結果
+BOM_PUSH_BATCH = int(os.getenv('BOM_PUSH_BATCH', '10'))
+# LINE 每次 reply/push 最多 5 則訊息
+LINE_MAX_MESSAGES = 5
+
+# --- 分批回覆設定 ---
+# 各廠商的結果一完成就先送出（第一批用 reply_message，之後用 push_message），
+# 設為 0 則等所有廠商完成後一次回覆（只用 reply_message，不消耗推播額度）
+PROGRESSIVE_REPLY_ENABLED = os.getenv('PROGRESSIVE_REPLY_ENABLED', '1') == '1'
+
+# --- 記錄、指標與追蹤設定 ---
+# 記錄以一行 JSON 輸出；一般流程（收到訊息、查詢完成等）只依比例抽樣輸出，警告與錯誤一律輸出
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+# 抽樣多少比例的事件記錄完整追蹤（各階段的開始時間與耗時），0 為停用
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+# 各階段耗時直方圖的區間（秒）與頁面大小直方圖的區間（bytes）
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+RESPONSE_SIZE_BUCKETS = (10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_000_000, 5_000_000)
+
+log = logging.getLogger('spider_code')
+if not log.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(_log_handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
 @app.route("/webhook", methods=['POST'])
 def webhook():
+    started = time.perf_counter()
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
 
     try:
-        handler.handle(body, signature)
+        events = parser.parse(body, signature)
     except InvalidSignatureError:
-        print("簽名無效。請檢查您的 Channel Access Token 或 Channel Secret 設定。")
+        webhook_requests.inc(status='invalid_signature')
+        log_event('webhook_invalid_signature', logging.WARNING,
+                  message="簽名無效。請檢查您的 Channel Access Token 或 Channel Secret 設定。")
         abort(400)
 
+    # 立即回應 200，避免 LINE 因等待查詢而逾時重送
+    for event in events:
+        enqueue_event(event)
+
+    webhook_requests.inc(status='ok')
+    webhook_seconds.observe(time.perf_counter() - started)
+    log_event('webhook', sampled=True, body_bytes=len(body), events=len(events))
     return 'OK'
 
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({
+        "jobs": job_stats.snapshot(_job_queue.qsize()),
+        "cache": lookup_cache.stats(),
+        "stages": stage_stats.snapshot(),
+        "vendors": {key: health.snapshot() for key, health in list(vendor_health.items())},
+        "prefetch": prefetch_stats,
+        "price_store": price_store.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "part_index": part_index.stats(),
+        "kss_catalog": {"entries": len(kss_index), "source_sha256": kss_index.source_sha256},
+        "single_flight": {
+            "searches": search_flight.stats(),
+            "vendor_fetches": vendor_flight.stats(),
+            "cross_process_shared": _cross_process_stats["shared"],
+        },
+    })
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def _start_background_threads():
+    # 在 worker 收到第一個請求時啟動（gunicorn fork 之後），避免執行緒在 fork 時遺失
+    _ensure_prefetcher()
+    _ensure_kss_catalog_refresher()
+    _ensure_part_index_seeder()
+
+# --- 背景工作佇列 ---
+def enqueue_event(event):
+    _ensure_job_workers()
+    try:
+        _job_queue.put_nowait((event, time.monotonic()))
+        job_stats.incr('enqueued')
+    except queue.Full:
+        # 佇列已滿時直接丟棄，避免 webhook 被卡住；LINE 重送只會讓佇列更擁擠
+        job_stats.incr('rejected')
+        log_event('job_rejected', logging.WARNING, queue_size=JOB_QUEUE_SIZE,
+                  event_id=getattr(event, 'webhook_event_id', ''))
+
+def _ensure_job_workers():
+    # 在第一次收到事件時才啟動背景執行緒（gunicorn fork 之後才會建立）
+    if _job_workers:
+        return
+    with _job_workers_lock:
+        if _job_workers:
+            return
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=_job_worker, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            _job_workers.append(worker)
+
+def _job_worker():
+    while True:
+        event, enqueued_at = _job_queue.get()
+        started_at = time.monotonic()
+        ok = True
+        try:
+            with start_trace('job', event_id=getattr(event, 'webhook_event_id', '')):
+                dispatch_event(event)
+        except Exception as e:
+            ok = False
+            log_event('job_failed', logging.ERROR, error=repr(e))
+        finally:
+            job_stats.record_job(started_at - enqueued_at, time.monotonic() - started_at, ok)
+            _job_queue.task_done()
+
+def dispatch_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+
+def send_reply(event, messages):
+    """
+    reply token 還有效時使用 reply_message（免費），
+    逾時或回覆失敗時改用 push_message 傳給原本的使用者/群組/聊天室。
+    reply 只能使用一次且最多 5 則，超過的部分以 push_message 接著傳送。
+    """
+    token_age = time.time() - event.timestamp / 1000
+    if event.reply_token and token_age < REPLY_TOKEN_TTL_SECONDS:
+        try:
+            line_bot_api.reply_message(event.reply_token, messages[:LINE_MAX_MESSAGES])
+            job_stats.incr('replied')
+            messages = messages[LINE_MAX_MESSAGES:]
+        except LineBotApiError as e:
+            log_event('reply_failed', logging.WARNING, status=e.status_code, fallback='push_message')
+
+    push_messages(event, messages)
+
+def push_messages(event, messages):
+    """以 push_message 傳送，超過 LINE 單次 5 則的上限時分批傳送。"""
+    for i in range(0, len(messages), LINE_MAX_MESSAGES):
+        line_bot_api.push_message(_push_target(event.source), messages[i:i + LINE_MAX_MESSAGES])
+        job_stats.incr('pushed')
+
+def _push_target(source):
+    if source.type == 'group':
+        return source.group_id
+    if source.type == 'room':
+        return source.room_id
+    return source.user_id
+
 # --- 網路爬蟲函式入口 ---
 def search_component_info(component_name):
     """
     根據料件名稱，從設定的多個網站搜尋資訊。
+    同時有多個人查詢同一個料號時，只會實際查詢一次，大家共用結果。
     """
+    started = time.perf_counter()
+    results = search_flight.do(
+        normalize_component_name(component_name),
+        lambda: _search_component_info(component_name),
+    )
+    elapsed = time.perf_counter() - started
+    search_seconds.observe(elapsed)
+    log_event('search', sampled=True, part=component_name, results=len(results), ms=round(elapsed * 1000, 1))
+    return list(results)
+
+def _search_component_info(component_name):
+    # 依照固定的廠商順序整理結果，而不是完成的順序
+    vendors = enabled_vendors()
+    results_by_vendor = {vendor.key: vendor_results for vendor, vendor_results in iter_vendor_results(component_name, vendors)}
     all_results = []
-    
-    # 獲取一個隨機的 User-Agent 和基礎 HTTP 標頭
-  # Inside search_component_info function
+    for vendor in vendors:
+        all_results.extend(results_by_vendor.get(vendor.key, []))
+
+    # KSS 沒有搜尋頁，從本機的型錄索引查詢
+    all_results.extend(handle_kss_pdf_info(component_name))
+
+    return all_results
+
+def iter_vendor_results(component_name, vendors=None):
+    """
+    同時查詢所有廠商，依完成的先後產生 (廠商, 結果 list)。
+    超過 SEARCH_DEADLINE_SECONDS 還沒完成的廠商，最後以逾時訊息產生。
+    """
+    base_headers = build_request_headers()
+    if vendors is None:
+        vendors = enabled_vendors()
+
+    # 所有廠商同時查詢；禮貌性延遲改由 fetch_page 針對各別 host 處理，
+    # 整體耗時約等於最慢的那一家，而不是五家加總。
+    # 每個工作各自複製一份 context，讓執行緒池裡的各階段也記錄到同一個追蹤。
+    deadline = time.monotonic() + SEARCH_DEADLINE_SECONDS
+    futures = {
+        _search_executor.submit(
+            contextvars.copy_context().run, cached_scrape, vendor, component_name, base_headers, deadline): vendor
+        for vendor in vendors
+    }
+    remaining = dict(futures)
+    try:
+        for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+            vendor = remaining.pop(future)
+            yield vendor, _vendor_future_results(vendor, future)
+    except FuturesTimeoutError:
+        pass
+
+    # 尚未完成的廠商以逾時訊息呈現（剛好在截止時間完成的仍使用結果）
+    for future, vendor in remaining.items():
+        if future.done():
+            yield vendor, _vendor_future_results(vendor, future)
+            continue
+        log_event('vendor_deadline_exceeded', logging.WARNING, vendor=vendor.key, deadline=SEARCH_DEADLINE_SECONDS)
+        yield vendor, [VendorResult(vendor.name, ResultStatus.TIMEOUT)]
+
+def _vendor_future_results(vendor, future):
+    try:
+        return future.result()
+    except Exception as e:
+        log_event('vendor_failed', logging.ERROR, vendor=vendor.key, error=repr(e))
+        return [VendorResult(vendor.name, ResultStatus.FAILED)]
+
+def build_request_headers():
+    """
+    獲取一個隨機的 User-Agent 和基礎 HTTP 標頭。
+    """
     random_user_agent = random.choice(USER_AGENTS)
     base_headers = {
         'User-Agent': random_user_agent,
@@ -78,399 +535,2632 @@ def search_component_info(component_name):
     }
     # 注意：'Origin' 這個 Header 有時會很敏感，如果加入後依然報錯，可以考慮移除它。
     # 因為它通常只在跨域請求時使用，這裡我們直接訪問目標網站。
-    # 我們將依序呼叫各個網站的爬蟲函數，並在每次呼叫後添加隨機延遲
-    
-    # 1. 搜尋 RS Components
-    rs_results = scrape_rs_components(component_name, base_headers)
-    if rs_results:
-        all_results.extend(rs_results)
-    time.sleep(random.uniform(2, 5)) # 隨機延遲 2 到 5 秒
-
-    # 2. 搜尋 WAGO
-    wago_results = scrape_wago(component_name, base_headers)
-    if wago_results:
-        all_results.extend(wago_results)
-    time.sleep(random.uniform(2, 5))
-
-    # 3. 搜尋 Digi-Key
-    digikey_results = scrape_digikey(component_name, base_headers)
-    if digikey_results:
-        all_results.extend(digikey_results)
-    time.sleep(random.uniform(2, 5))
-
-    # 4. 搜尋 Mouser
-    mouser_results = scrape_mouser(component_name, base_headers)
-    if mouser_results:
-        all_results.extend(mouser_results)
-    time.sleep(random.uniform(2, 5))
-        
-    # 5. 搜尋 Octopart
-    octopart_results = scrape_octopart(component_name, base_headers)
-    if octopart_results:
-        all_results.extend(octopart_results)
-    # KSS 是 PDF，不需要延遲
-
-    # 6. KSS PDF (特殊處理，說明困難點)
-    kss_info = handle_kss_pdf_info()
-    all_results.append(kss_info)
+    return base_headers
 
-    return all_results
-
-# --- 各個網站的專屬爬蟲函數 ---
-# 請再次注意：以下程式碼的 CSS Selector (例如 class_='...') 都是範例，
-# 您必須實際訪問網站，按 F12 檢查其 HTML 結構來獲取正確的 Selector。
+def throttle_request(url, timeout, vendor_key='', deadline=None):
+    """
+    等待 url 所在 host 的請求額度，回傳實際可用的 timeout。對同一個 host 的請求頻率由 token bucket 限制
+    （同一台機器的 worker 共用額度），只在該網站的額度用完時才等待；不同 host 之間互不影響。
+    deadline（time.monotonic() 的時間點）之前拿不到額度時丟出 RateLimitExceeded；
+    等待之後 timeout 也不會超過剩餘的時間。
+    """
+    host = urlsplit(url).hostname
+    label = vendor_key or host
+    _host_labels[host] = label
+    rate, burst = host_rate_limit(host)
+    max_wait = None if deadline is None else deadline - time.monotonic()
+    waited = rate_limiter.acquire(host, rate, burst, max_wait)
+    if waited > 0:
+        observe_stage('rate_limit_wait', label, waited)
+    if deadline is not None:
+        timeout = max(0.1, min(timeout, deadline - time.monotonic()))
+    return timeout
+
+def fetch_page(url, headers, timeout, vendor_key='', deadline=None, throttle=True):
+    """
+    發送 GET 請求，throttle 為 True 時先以 throttle_request 等待請求額度
+    （呼叫端已經自行呼叫 throttle_request 時傳入 False）。
+    vendor_key 用於指標的標籤，分別記錄等待回應標頭（ttfb）與下載內容（download）的時間。
+    """
+    host = urlsplit(url).hostname
+    label = vendor_key or host
+    if throttle:
+        timeout = throttle_request(url, timeout, vendor_key, deadline)
+
+    if FETCH_BACKEND == 'aiohttp':
+        response, download_seconds = async_fetcher.get(url, headers, timeout, label)
+        observe_stage('ttfb', label, response.elapsed.total_seconds())
+        observe_stage('download', label, download_seconds)
+        response_bytes.observe(len(response.content), vendor=label)
+        return response
+
+    session, semaphore = get_host_session(host)
+    with semaphore:
+        response = session.get(url, headers=headers, timeout=timeout, stream=True)
+        observe_stage('ttfb', label, response.elapsed.total_seconds())
+        download_started = time.perf_counter()
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            if MAX_RESPONSE_BYTES and size > MAX_RESPONSE_BYTES:
+                response.close() # 剩下的內容不下載，這條連線也不放回連線池
+                break
+        response._content = cap_response_body(b''.join(chunks), label)
+        observe_stage('download', label, time.perf_counter() - download_started)
+    response_bytes.observe(len(response.content), vendor=label)
+    return response
+
+def cap_response_body(content, label):
+    """超過 MAX_RESPONSE_BYTES 時截斷內容並記錄（兩種下載方式共用）。"""
+    if not MAX_RESPONSE_BYTES or len(content) <= MAX_RESPONSE_BYTES:
+        return content
+    responses_truncated.inc(vendor=label)
+    log_event('response_truncated', logging.WARNING, vendor=label, max_bytes=MAX_RESPONSE_BYTES)
+    return content[:MAX_RESPONSE_BYTES]
+
+class AsyncFetcher:
+    """
+    FETCH_BACKEND=aiohttp 時使用：在背景執行緒跑一個 asyncio event loop，
+    所有廠商的請求共用一個 aiohttp ClientSession。連線數由 TCPConnector 的 limit_per_host 限制，
+    DNS 結果也會快取；查詢執行緒只等待結果，不再各自佔用連線池與 socket。
+    重試規則與 requests 的設定相同（連線失敗與 429/5xx，讀取逾時不重試）。
+    回傳 requests.Response，呼叫端（raise_for_status、decode_body）不需要區分。
+    """
+    def __init__(self):
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # 第一次使用時才建立（gunicorn fork 之後），event loop 無法跨 fork 使用
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='fetch-loop', daemon=True).start()
+                self._session = asyncio.run_coroutine_threadsafe(self._create_session(), loop).result()
+                self._loop = loop
+                atexit.register(self.close)
+        return self._loop
+
+    def close(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+
+    async def _create_session(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_dns_resolvehost_start.append(self._on_start('dns'))
+        trace.on_dns_resolvehost_end.append(self._on_end('dns'))
+        trace.on_connection_create_start.append(self._on_start('connect'))
+        trace.on_connection_create_end.append(self._on_end('connect'))
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=HOST_MAX_CONCURRENCY, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+
+    @staticmethod
+    def _on_start(stage):
+        async def on_start(session, context, params):
+            setattr(context, f'{stage}_started', time.perf_counter())
+        return on_start
+
+    @staticmethod
+    def _on_end(stage):
+        # aiohttp 的建立連線包含 DNS 查詢、TCP 連線與 TLS 握手；DNS 另外記錄，connect 扣掉 DNS 的時間
+        async def on_end(session, context, params):
+            seconds = time.perf_counter() - getattr(context, f'{stage}_started')
+            if stage == 'dns':
+                context.dns_seconds = seconds
+            else:
+                seconds -= getattr(context, 'dns_seconds', 0.0)
+            observe_stage(stage, context.trace_request_ctx["label"], seconds)
+        return on_end
+
+    def get(self, url, headers, timeout, label):
+        """回傳 (requests.Response, 下載內容的秒數)；response.elapsed 為收到回應標頭的時間。"""
+        if not _AIOHTTP_BROTLI:
+            # 沒有安裝 brotli 時 aiohttp 無法解壓縮 br，只接受 gzip/deflate
+            headers = {**headers, 'Accept-Encoding': 'gzip, deflate'}
+        future = asyncio.run_coroutine_threadsafe(self._get(url, headers, timeout, label), self._ensure_loop())
+        return future.result()
+
+    async def _get(self, url, headers, timeout, label):
+        client_timeout = aiohttp.ClientTimeout(total=None, connect=timeout, sock_read=timeout)
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                async with self._session.get(url, headers=headers, timeout=client_timeout,
+                                             trace_request_ctx={"label": label}) as resp:
+                    headers_seconds = time.perf_counter() - started
+                    chunks = []
+                    size = 0
+                    async for chunk in resp.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if MAX_RESPONSE_BYTES and size > MAX_RESPONSE_BYTES:
+                            break # 離開 async with 時 aiohttp 會關閉這條沒讀完的連線
+                    content = cap_response_body(b''.join(chunks), label)
+                    download_seconds = time.perf_counter() - started - headers_seconds
+                    if resp.status in _RETRY_STATUSES and attempt < HTTP_MAX_RETRIES:
+                        await asyncio.sleep(self._backoff(attempt, resp.headers.get('Retry-After')))
+                        continue
+                    return self._to_response(resp, content, url, headers_seconds), download_seconds
+            except aiohttp.ClientConnectorError as e:
+                if attempt < HTTP_MAX_RETRIES:
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                raise requests.exceptions.ConnectionError(f"{url}: {e}") from e
+            except asyncio.TimeoutError as e:
+                raise requests.exceptions.ReadTimeout(f"{url}: 逾時（{timeout:.1f} 秒）") from e
+            except aiohttp.ClientError as e:
+                raise requests.exceptions.ConnectionError(f"{url}: {e}") from e
+
+    @staticmethod
+    def _backoff(attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), RETRY_AFTER_MAX)
+        return HTTP_BACKOFF_FACTOR * (2 ** attempt)
+
+    @staticmethod
+    def _to_response(resp, content, url, headers_seconds):
+        response = requests.Response()
+        response.status_code = resp.status
+        response.reason = resp.reason
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response.url = str(resp.url)
+        response._content = content
+        response.elapsed = timedelta(seconds=headers_seconds)
+        response.request = requests.Request('GET', url).prepare()
+        return response
+
+async_fetcher = AsyncFetcher()
+
+class _TimedConnectionMixin:
+    """
+    建立新連線時先自行查詢 DNS（記錄為 dns），再依序連線到查到的位址（記錄為 connect），
+    階段名稱與 aiohttp 相同。連線失敗時和 urllib3 一樣改試下一個位址。
+    """
+    _new_conn_seconds = 0.0
+
+    def _new_conn(self):
+        label = _host_labels.get(self.host, self.host)
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        resolved = time.perf_counter()
+        observe_stage('dns', label, resolved - started)
+
+        dns_host = self._dns_host
+        error = None
+        try:
+            for address in dict.fromkeys(info[4][0] for info in addresses):
+                # 只換掉連線的位址；Host 標頭與 TLS 憑證驗證仍使用原本的 host
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+            else:
+                raise error
+        finally:
+            self._dns_host = dns_host
+        observe_stage('connect', label, time.perf_counter() - resolved)
+        self._new_conn_seconds = time.perf_counter() - started
+        return sock
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    """記錄建立新連線的 DNS 查詢與 TCP 連線時間。"""
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    """除了 DNS 查詢與 TCP 連線，另外記錄 TLS 握手的時間。"""
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        # connect() 包含 _new_conn()，扣掉已記錄的 DNS + 連線時間就是 TLS 握手
+        tls_seconds = time.perf_counter() - started - self._new_conn_seconds
+        observe_stage('tls', _host_labels.get(self.host, self.host), tls_seconds)
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _InstrumentedAdapter(HTTPAdapter):
+    """連線池改用會記錄連線與 TLS 時間的連線類別。"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+class _CappedRetry(Retry):
+    """遵守 Retry-After，但等待時間不超過 RETRY_AFTER_MAX。"""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+def get_host_session(host):
+    """
+    取得該 host 專用的 Session 與並行數限制。Session 在第一次使用時建立
+    （gunicorn fork 之後），之後所有執行緒共用同一個連線池。
+    """
+    session = _host_sessions.get(host)
+    if session is not None:
+        return session, _host_semaphores[host]
+    with _session_lock:
+        if host not in _host_sessions:
+            retry = _CappedRetry(
+                total=HTTP_MAX_RETRIES,
+                connect=HTTP_MAX_RETRIES,
+                read=0, # 讀取逾時不重試，避免一次查詢等上好幾倍的 timeout
+                status=HTTP_MAX_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=_RETRY_STATUSES,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = _InstrumentedAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _host_semaphores[host] = threading.BoundedSemaphore(HOST_MAX_CONCURRENCY)
+            _host_sessions[host] = session
+        return _host_sessions[host], _host_semaphores[host]
+
+# --- 每個 host 的請求頻率限制 ---
+class RateLimitExceeded(Exception):
+    """在截止時間之前拿不到該網站的請求額度。"""
+
+class HostRateLimiter:
+    """
+    每個 host 一個 token bucket：每秒補充 rate 個 token，最多累積 burst 個，每個請求消耗一個。
+    token 不夠時先預約（token 數變成負數）再等待，排隊中的請求會依序錯開，等待期間不持有鎖。
+    有設定 directory 且支援 fcntl 時，狀態（token 數, 更新時間）存在檔案中並以檔案鎖保護，
+    同一台機器上的所有 gunicorn worker 共用同一份額度；否則只在 process 內共用。
+    """
+    _STATE = struct.Struct('dd')
+
+    def __init__(self, directory):
+        self.directory = directory if fcntl is not None else ''
+        self.enabled = True
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rejected = 0
+        self._local = {} # host -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, host, rate, burst, max_wait=None):
+        """
+        取得一個 token，額度不足時等待，回傳等待的秒數。
+        需要等待的時間超過 max_wait 時不預約，丟出 RateLimitExceeded。
+        """
+        if not self.enabled or rate <= 0:
+            return 0.0
+        if self.directory:
+            wait = self._reserve_shared(host, rate, burst, max_wait)
+        else:
+            with self._lock:
+                now = time.time()
+                tokens, wait = self._take(self._local.get(host, (burst, now)), rate, burst, max_wait, now)
+                if wait is not None:
+                    self._local[host] = (tokens, now)
+        if wait is None:
+            with self._lock:
+                self.rejected += 1
+            raise RateLimitExceeded(f"{host}: 請求額度不足，{max_wait:.1f} 秒內無法發送")
+        if wait > 0:
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += wait
+            time.sleep(wait)
+        return wait
+
+    @staticmethod
+    def _take(state, rate, burst, max_wait, now):
+        # 依經過的時間補充 token 後扣掉一個；不夠時要等到補回 0 為止
+        tokens, updated_at = state
+        tokens = min(burst, tokens + max(0.0, now - updated_at) * rate) - 1
+        wait = max(0.0, -tokens / rate)
+        if max_wait is not None and wait > max_wait:
+            return tokens + 1, None
+        return tokens, wait
+
+    def _reserve_shared(self, host, rate, burst, max_wait):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, re.sub(r'[^\w.-]', '_', host) + '.bucket')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, self._STATE.size, 0)
+            now = time.time()
+            state = self._STATE.unpack(data) if len(data) == self._STATE.size else (burst, now)
+            tokens, wait = self._take(state, rate, burst, max_wait, now)
+            if wait is not None:
+                os.pwrite(fd, self._STATE.pack(tokens, now), 0)
+            return wait
+        finally:
+            os.close(fd) # 關閉檔案時一併釋放檔案鎖
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "shared": bool(self.directory),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "rejected": self.rejected,
+            }
+
+rate_limiter = HostRateLimiter(RATE_LIMIT_DIR)
+
+def host_rate_limit(host):
+    """回傳該 host 的 (每秒請求數, 最多連續請求數)，廠商設定了 rate/burst 時優先使用。"""
+    vendor = _VENDOR_HOSTS.get(host)
+    rate = vendor.rate if vendor is not None and vendor.rate is not None else HOST_RATE
+    burst = vendor.burst if vendor is not None and vendor.burst is not None else HOST_BURST
+    return rate, max(1.0, burst)
+
+# --- 各階段耗時統計 ---
+class StageStats:
+    """
+    累計查詢流程各階段（fetch/parse/extract/format）的次數、實際耗時與 CPU 時間，
+    依 (階段, 廠商) 分開統計。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {} # (stage, vendor) -> [count, wall_seconds, cpu_seconds]
+
+    def record(self, stage, vendor, wall_seconds, cpu_seconds):
+        with self._lock:
+            totals = self._totals.setdefault((stage, vendor), [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall_seconds
+            totals[2] += cpu_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "stage": stage,
+                    "vendor": vendor,
+                    "count": count,
+                    "wall_seconds": round(wall, 6),
+                    "cpu_seconds": round(cpu, 6),
+                }
+                for (stage, vendor), (count, wall, cpu) in sorted(self._totals.items())
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+stage_stats = StageStats()
+
+@contextmanager
+def stage_timer(stage, vendor=''):
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - wall_started
+        stage_stats.record(stage, vendor, wall_seconds, time.thread_time() - cpu_started)
+        observe_stage(stage, vendor, wall_seconds, started=wall_started)
+
+def observe_stage(stage, vendor, seconds, started=None):
+    """記錄到各階段耗時直方圖；有進行中的追蹤時也加入一個 span。"""
+    stage_seconds.observe(seconds, stage=stage, vendor=vendor)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, vendor, time.perf_counter() - seconds if started is None else started, seconds)
+
+# --- Prometheus 指標 ---
+_metrics = []
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+def _metric_header(name, help_text, kind):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+
+class Counter:
+    """依標籤分開累計、只會增加的計數器。"""
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = _metric_header(self.name, self.help_text, 'counter')
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(list(zip(self.labels, key)))} {value}')
+        return lines
+
+class Histogram:
+    """依標籤分開統計的直方圖，輸出 Prometheus 的累積區間格式。"""
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {} # labels -> [各區間次數, 總和]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = _metric_header(self.name, self.help_text, 'histogram')
+        for key, (counts, total) in items:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (None,), counts):
+                cumulative += count
+                le = '+Inf' if bound is None else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(pairs + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(pairs)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{_format_labels(pairs)} {cumulative}')
+        return lines
+
+webhook_requests = Counter('spider_webhook_requests_total', 'LINE webhook 請求數', ('status',))
+webhook_seconds = Histogram('spider_webhook_seconds', 'webhook 驗證簽名並放進佇列的耗時')
+search_seconds = Histogram('spider_search_seconds', '單一料號查詢所有廠商的耗時（含合併等待）')
+first_answer_seconds = Histogram('spider_first_answer_seconds', '使用者傳送訊息到收到第一批查詢結果的時間（分批回覆）')
+stage_seconds = Histogram(
+    'spider_stage_seconds',
+    '各階段耗時：rate_limit_wait、dns、connect（TCP，aiohttp 含 TLS）、tls、ttfb、download、fetch、parse、extract、format',
+    ('stage', 'vendor'),
+)
+response_bytes = Histogram('spider_response_bytes', '廠商頁面解壓縮後的大小', ('vendor',), RESPONSE_SIZE_BUCKETS)
+responses_truncated = Counter('spider_responses_truncated_total', '超過 MAX_RESPONSE_BYTES 而截斷的頁面數', ('vendor',))
+vendor_requests = Counter(
+    'spider_vendor_requests_total',
+    '各廠商請求結果（ok/captcha/timeout/error/skipped/rate_limited/deadline）',
+    ('vendor', 'outcome'),
+)
+
+_BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def _gauge_lines(name, help_text, samples, kind='gauge'):
+    lines = _metric_header(name, help_text, kind)
+    for labels, value in samples:
+        lines.append(f'{name}{_format_labels(sorted(labels.items()))} {value}')
+    return lines
+
+def render_metrics():
+    """以 Prometheus 文字格式輸出所有指標，佇列、快取等狀態在輸出時才讀取。"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    jobs = job_stats.snapshot(_job_queue.qsize())
+    lines += _gauge_lines('spider_job_queue_depth', '背景工作佇列中等待處理的事件數', [({}, jobs["queue_depth"])])
+    lines += _gauge_lines('spider_job_queue_capacity', '背景工作佇列的容量', [({}, jobs["queue_capacity"])])
+    lines += _gauge_lines('spider_jobs_total', '背景工作處理結果', [
+        ({"result": result}, jobs[result]) for result in ('completed', 'failed', 'rejected')
+    ], 'counter')
+    lines += _gauge_lines('spider_replies_total', '回覆方式', [
+        ({"method": "reply"}, jobs["replied"]), ({"method": "push"}, jobs["pushed"]),
+    ], 'counter')
+
+    cache = lookup_cache.stats()
+    lines += _gauge_lines('spider_cache_entries', '查詢結果快取的筆數', [({}, cache["entries"])])
+    lines += _gauge_lines('spider_cache_lookups_total', '查詢結果快取的查詢次數', [
+        ({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"]),
+    ], 'counter')
+    lines += _gauge_lines('spider_cache_evictions_total', '因容量不足被淘汰的快取筆數', [({}, cache["evictions"])], 'counter')
+
+    store = price_store.stats()
+    lines += _gauge_lines('spider_price_store_lookups_total', '價格資料庫的查詢次數', [
+        ({"result": "hit"}, store["hits"]), ({"result": "miss"}, store["misses"]),
+    ], 'counter')
+    lines += _gauge_lines('spider_price_store_written_total', '寫入價格資料庫的筆數', [({}, store["written"])], 'counter')
+
+    flights = {"search": search_flight.stats(), "vendor": vendor_flight.stats()}
+    lines += _gauge_lines('spider_single_flight_shared_total', '與其他相同查詢合併的次數', [
+        ({"scope": scope}, stats["shared"]) for scope, stats in flights.items()
+    ] + [({"scope": "cross_process"}, _cross_process_stats["shared"])], 'counter')
+    lines += _gauge_lines('spider_single_flight_in_flight', '進行中的查詢數', [
+        ({"scope": scope}, stats["in_flight"]) for scope, stats in flights.items()
+    ])
+
+    index = part_index.stats()
+    lines += _gauge_lines('spider_part_index_entries', '料號索引中的料號數', [({}, index["entries"])])
+    lines += _gauge_lines('spider_part_index_lookups_total', '料號索引的對應結果', [
+        ({"result": result}, count) for result, count in sorted(index["lookups"].items())
+    ], 'counter')
+
+    limits = rate_limiter.stats()
+    lines += _gauge_lines('spider_rate_limit_rejected_total', '在截止時間前拿不到請求額度而略過的次數', [({}, limits["rejected"])], 'counter')
+
+    healths = sorted(vendor_health.items())
+    lines += _gauge_lines('spider_vendor_breaker_state', '斷路器狀態（0=closed, 1=half_open, 2=open）', [
+        ({"vendor": key}, _BREAKER_STATES[health.state]) for key, health in healths
+    ])
+    lines += _gauge_lines('spider_vendor_breaker_trips_total', '斷路器跳脫次數', [
+        ({"vendor": key}, health.trips) for key, health in healths
+    ], 'counter')
+    return '\n'.join(lines) + '\n'
+
+# --- 追蹤與結構化記錄 ---
+_current_trace = contextvars.ContextVar('spider_trace', default=None)
+
+class Trace:
+    """一次事件處理中各階段的 span（相對開始時間、耗時、執行緒），結束時輸出成一行記錄。"""
+    def __init__(self, name):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, vendor, started, seconds):
+        span = {
+            "stage": stage,
+            "vendor": vendor,
+            "start_ms": round((started - self.started) * 1000, 1),
+            "ms": round(seconds * 1000, 1),
+            "thread": threading.current_thread().name,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+@contextmanager
+def start_trace(name, **fields):
+    """依 TRACE_SAMPLE_RATE 抽樣建立追蹤；沒被抽中時不做任何記錄。"""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        yield None
+        return
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        log_event('trace', trace_id=trace.trace_id, name=name,
+                  ms=round((time.perf_counter() - trace.started) * 1000, 1),
+                  spans=sorted(trace.spans, key=lambda span: span["start_ms"]), **fields)
+
+def log_event(event, level=logging.INFO, sampled=False, **fields):
+    """
+    以一行 JSON 輸出結構化記錄。sampled=True 的記錄只依 LOG_SAMPLE_RATE 抽樣輸出，
+    用於每次查詢都會出現的一般訊息；在追蹤中的記錄會附上 trace_id。
+    """
+    if sampled and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if not log.isEnabledFor(level):
+        return
+    record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event}
+    trace = _current_trace.get()
+    if trace is not None:
+        record["trace_id"] = trace.trace_id
+    record.update(fields)
+    log.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+# --- 查詢結果快取 ---
+_DASHES = re.compile(r'[\u2010-\u2015\u2212]')
+_SEPARATORS = re.compile(r'[\s\-]+')
+
+def normalize_component_name(component_name):
+    """
+    將料號正規化作為快取的 key：全形轉半形、統一大寫、
+    各種破折號與空白都視為同一個分隔符號。
+    例如 '2273-202'、' 2273  202 '、'２２７３－２０２' 都會得到 '2273-202'。
+    """
+    text = unicodedata.normalize('NFKC', component_name).upper()
+    text = _DASHES.sub('-', text)
+    return _SEPARATORS.sub('-', text).strip('-')
 
-def scrape_rs_components(component_name, headers): # <--- 已修改
-    vendor_results = []
-    search_url = f"https://twcn.rs-online.com/web/search/searchBrowseAction.html?sra=grp&searchTerm={component_name}"
+class LookupCache:
+    """
+    有 TTL 與 LRU 淘汰機制的執行緒安全快取，並統計命中率。
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key):
+        """取得還沒過期的值，不影響命中率統計與 LRU 順序；不存在或已過期時回傳 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def ttl_remaining(self, key):
+        """回傳剩餘的有效秒數（不存在或已過期為 0），不影響命中率統計與 LRU 順序。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return max(0.0, entry[0] - time.monotonic()) if entry else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+lookup_cache = LookupCache(LOOKUP_CACHE_SIZE)
+
+def cached_scrape(vendor, component_name, headers, deadline=None):
+    """
+    在各廠商爬蟲前面加一層快取。正常結果依廠商設定的 cache_ttl 保存，
+    含有錯誤的結果（反爬蟲、逾時等）則使用較短的 NEGATIVE_CACHE_TTL。
+    因斷路器而略過的結果不快取，冷卻結束後就能馬上重試。
+    """
+    key = (vendor.key, normalize_component_name(component_name))
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    # 其他 worker 或先前查過、還夠新的資料直接從資料庫取出
+    last_known = price_store.last_known(key[1], vendor.key, max_age=vendor.cache_ttl)
+    if last_known is not None:
+        vendor_results, fetched_at = last_known
+        ttl = vendor.cache_ttl
+        if not vendor_results and vendor.not_found_error:
+            # 「找不到」的紀錄和其他錯誤一樣只沿用 NEGATIVE_CACHE_TTL
+            vendor_results = [VendorResult(vendor.name, ResultStatus.NOT_FOUND, fetched_at=fetched_at)]
+            ttl = NEGATIVE_CACHE_TTL
+        ttl -= time.time() - fetched_at
+        if ttl > 0:
+            lookup_cache.set(key, tuple(vendor_results), ttl)
+            return vendor_results
+    return scrape_and_cache(vendor, key, component_name, headers, deadline)
+
+def scrape_and_cache(vendor, key, component_name, headers, deadline=None):
+    """實際查詢並寫入快取（不先讀快取），預先查詢也會直接呼叫這裡來更新資料。"""
+    # 同一個廠商 + 料號同時只會有一個請求在進行，其他執行緒/worker 等待並共用結果
+    vendor_results = vendor_flight.do(key, lambda: run_cross_process(
+        f"{key[0]}:{key[1]}",
+        lambda: _scrape_and_record(vendor, key, component_name, headers, deadline),
+        deadline,
+        encode=lambda results: [item.to_dict(placeholders=False) for item in results],
+        decode=lambda items: [VendorResult.from_dict(item) for item in items],
+    ))
+    if any(item.skipped for item in vendor_results):
+        return list(vendor_results)
+    if not all(item.ok for item in vendor_results):
+        ttl = NEGATIVE_CACHE_TTL
+    else:
+        ttl = vendor.cache_ttl
+    lookup_cache.set(key, tuple(vendor_results), ttl)
+    return list(vendor_results)
+
+def _scrape_and_record(vendor, key, component_name, headers, deadline):
+    # 只有實際查詢的那一方會執行這裡，確保同一份結果只寫入資料庫一次
+    vendor_results = run_vendor_scraper(vendor, component_name, headers, deadline)
+    if all(item.ok for item in vendor_results):
+        fetched_at = time.time()
+        for item in vendor_results:
+            item.fetched_at = fetched_at
+        price_store.record(key[1], vendor.key, vendor.name, vendor_results, fetched_at)
+        if vendor_results:
+            part_index.add(key[1], [item.name for item in vendor_results])
+    elif all(item.status == ResultStatus.NOT_FOUND for item in vendor_results):
+        # 以空白紀錄保存「找不到」，其他 worker 與快取過期後也能判斷這個料號最近查無結果
+        price_store.record(key[1], vendor.key, vendor.name, [], time.time())
+    return vendor_results
 
-    try:
-        response = requests.get(search_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+# --- 價格/庫存歷史資料庫 ---
+def _decayed_score(score, elapsed, half_life):
+    # 其他 worker 可能寫入較晚的時間，經過時間為負數時不遞減
+    return score * 0.5 ** (max(0.0, elapsed) / half_life)
 
-        product_rows = soup.find_all('tr', class_='product-row') 
+class PriceStore:
+    """
+    以 SQLite（WAL 模式）保存每次查詢到的正常結果，依 (正規化料號, 廠商, 時間) 建立索引。
+    - last_known：取得某料號在某廠商最近一次、且不超過 max_age 秒的結果
+    - history：價格/庫存的歷史紀錄
+    - record_query / top_queries：所有 worker 共用的料號查詢頻率，作為預先查詢的優先順序
+    - known_parts：每個料號與結果名稱的摘要（parts 表），作為料號索引的初始資料
+    寫入由背景執行緒批次處理，並每小時刪除超過 PRICE_RETENTION_DAYS 的紀錄；讀取每個執行緒各自使用一個連線。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY,
+            part_key TEXT NOT NULL,
+            vendor_key TEXT NOT NULL,
+            vendor TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            name TEXT,
+            link TEXT,
+            price TEXT,
+            stock TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_results_part_vendor_time ON results (part_key, vendor_key, fetched_at);
+        CREATE INDEX IF NOT EXISTS idx_results_time ON results (fetched_at);
+        CREATE TABLE IF NOT EXISTS parts (
+            part_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            last_seen REAL NOT NULL,
+            PRIMARY KEY (part_key, name)
+        );
+        CREATE INDEX IF NOT EXISTS idx_parts_last_seen ON parts (last_seen);
+        CREATE TABLE IF NOT EXISTS queries (
+            part_key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            score REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+    INSERT_RESULTS = (
+        'INSERT INTO results (part_key, vendor_key, vendor, fetched_at, name, link, price, stock) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+    )
+    UPSERT_PART = (
+        'INSERT INTO parts (part_key, name, count, last_seen) VALUES (?, ?, 1, ?) '
+        'ON CONFLICT (part_key, name) DO UPDATE SET count = count + 1, last_seen = MAX(last_seen, excluded.last_seen)'
+    )
+    # score 是 updated_at 當下的分數；每次查詢先依經過的時間遞減再加一
+    UPSERT_QUERY = (
+        'INSERT INTO queries (part_key, name, score, updated_at) VALUES (?, ?, 1, ?) '
+        'ON CONFLICT (part_key) DO UPDATE SET name = excluded.name, '
+        'score = decay(score, excluded.updated_at - updated_at, ?) + 1, '
+        'updated_at = MAX(updated_at, excluded.updated_at)'
+    )
 
-        if not product_rows:
-            print(f"RS Components: 未找到 '{component_name}' 相關結果。")
+    def __init__(self, path):
+        self.path = path
+        self.written = 0
+        self.hits = 0
+        self.misses = 0
+        # 多個請求執行緒同時讀取，+= 不是原子操作
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._schema_ready = False
+        self._maintained_at = 0.0
+        self._query_half_life = None
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.create_function('decay', 3, _decayed_score, deterministic=True)
+            if not self._schema_ready:
+                connection.executescript(self.SCHEMA)
+                self._migrate(connection)
+                self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self, connection):
+        # 舊版資料庫沒有 parts 摘要表，從 results 補上一次（BEGIN IMMEDIATE 讓同時啟動的 worker 只有一個執行）
+        if connection.execute('PRAGMA user_version').fetchone()[0] >= 1:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('PRAGMA user_version').fetchone()[0] < 1:
+                connection.execute(
+                    'INSERT OR IGNORE INTO parts (part_key, name, count, last_seen) '
+                    'SELECT part_key, name, COUNT(*), MAX(fetched_at) FROM results WHERE name IS NOT NULL '
+                    'GROUP BY part_key, name'
+                )
+                connection.execute('PRAGMA user_version = 1')
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def record(self, part_key, vendor_key, vendor_name, vendor_results, fetched_at):
+        """放進寫入佇列。沒有結果時寫入一筆空白紀錄，代表「查過但找不到」。"""
+        if not self.path:
+            return
+        rows = [
+            (part_key, vendor_key, vendor_name, fetched_at,
+             item.name, item.link, item.price, item.stock)
+            for item in vendor_results
+        ] or [(part_key, vendor_key, vendor_name, fetched_at, None, None, None, None)]
+        self._ensure_writer()
+        self._queue.put((self.INSERT_RESULTS, rows))
+        names = [(part_key, item.name, fetched_at) for item in vendor_results if item.name]
+        if names:
+            self._queue.put((self.UPSERT_PART, names))
+
+    def record_query(self, part_key, name, queried_at, half_life):
+        """放進寫入佇列：料號被使用者查詢一次，分數以 half_life 秒的半衰期遞減。"""
+        if not self.path:
+            return
+        self._ensure_writer()
+        self._queue.put((self.UPSERT_QUERY, [(part_key, name, queried_at, half_life)]))
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='price-store', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batches = {} # SQL -> rows，依放進佇列的順序執行
+            sql, rows = self._queue.get()
+            batches[sql] = list(rows)
+            size = len(rows)
+            flush_at = time.monotonic() + PRICE_STORE_FLUSH_SECONDS
+            while size < PRICE_STORE_BATCH_SIZE:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    sql, rows = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batches.setdefault(sql, []).extend(rows)
+                size += len(rows)
+            try:
+                connection = self._connect()
+                with connection:
+                    for sql, rows in batches.items():
+                        connection.executemany(sql, rows)
+                self.written += len(batches.get(self.INSERT_RESULTS, ()))
+                if self.UPSERT_QUERY in batches:
+                    self._query_half_life = max(row[3] for row in batches[self.UPSERT_QUERY])
+                if time.time() - self._maintained_at >= 3600:
+                    self._maintained_at = time.time()
+                    self._prune(connection)
+            except sqlite3.Error as e:
+                log_event('price_store_write_failed', logging.ERROR, error=repr(e), rows=size)
+
+    def _prune(self, connection):
+        """刪除超過保留期限的結果與料號摘要，以及超過 10 個半衰期沒有人查詢（分數不到千分之一）的料號。"""
+        now = time.time()
+        removed = 0
+        if PRICE_RETENTION_DAYS > 0:
+            cutoff = now - PRICE_RETENTION_DAYS * 24 * 60 * 60
+            # 分批刪除，每次交易很短，不會長時間擋住其他 worker 的寫入
+            while True:
+                with connection:
+                    deleted = connection.execute(
+                        'DELETE FROM results WHERE id IN (SELECT id FROM results WHERE fetched_at < ? LIMIT 5000)',
+                        (cutoff,),
+                    ).rowcount
+                removed += deleted
+                if deleted < 5000:
+                    break
+            with connection:
+                connection.execute('DELETE FROM parts WHERE last_seen < ?', (cutoff,))
+        if self._query_half_life:
+            with connection:
+                connection.execute('DELETE FROM queries WHERE updated_at < ?', (now - 10 * self._query_half_life,))
+        if removed:
+            log_event('price_store_pruned', rows=removed)
+
+    def top_queries(self, n, half_life):
+        """所有 worker 記錄的查詢中，目前分數最高的 n 個 (使用者輸入的原文, 分數)。"""
+        if not self.path:
+            return []
+        try:
+            return self._connect().execute(
+                'SELECT name, decay(score, ? - updated_at, ?) AS current FROM queries ORDER BY current DESC LIMIT ?',
+                (time.time(), half_life, n),
+            ).fetchall()
+        except sqlite3.Error as e:
+            log_event('price_store_read_failed', logging.ERROR, error=repr(e))
             return []
 
-        for row in product_rows[:3]:
-            product_link_tag = row.find('a', class_='description-link')
-            product_price_tag = row.find('span', class_='price')
-            product_stock_tag = row.find('span', class_='stock-value')
-
-            if product_link_tag and product_price_tag:
-                title = product_link_tag.get_text(strip=True)
-                link = "https://twcn.rs-online.com" + product_link_tag['href']
-                price = product_price_tag.get_text(strip=True)
-                stock = product_stock_tag.get_text(strip=True) if product_stock_tag else "無資訊"
-
-                vendor_results.append({
-                    "vendor": "RS Components",
-                    "name": title,
-                    "link": link,
-                    "price": price,
-                    "stock": stock
-                })
+    def query_score(self, part_key, half_life):
+        if not self.path:
+            return 0.0
+        try:
+            row = self._connect().execute(
+                'SELECT decay(score, ? - updated_at, ?) FROM queries WHERE part_key = ?',
+                (time.time(), half_life, part_key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            log_event('price_store_read_failed', logging.ERROR, error=repr(e))
+            return 0.0
+        return row[0] if row else 0.0
+
+    def last_known(self, part_key, vendor_key, max_age):
+        """回傳 (結果 list, 查詢時間)；沒有資料或資料太舊時回傳 None。"""
+        if not self.path:
+            return None
+        try:
+            rows = self._connect().execute(
+                'SELECT vendor, fetched_at, name, link, price, stock FROM results '
+                'WHERE part_key = ? AND vendor_key = ? AND fetched_at = ('
+                '    SELECT MAX(fetched_at) FROM results WHERE part_key = ? AND vendor_key = ?'
+                ') AND fetched_at >= ? ORDER BY id',
+                (part_key, vendor_key, part_key, vendor_key, time.time() - max_age),
+            ).fetchall()
+        except sqlite3.Error as e:
+            log_event('price_store_read_failed', logging.ERROR, error=repr(e))
+            return None
+        with self._stats_lock:
+            if rows:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not rows:
+            return None
+        fetched_at = rows[0][1]
+        vendor_results = [
+            VendorResult(vendor, name=name, link=link, price=price, stock=stock, fetched_at=fetched_at)
+            for vendor, _, name, link, price, stock in rows
+            if name is not None
+        ]
+        return vendor_results, fetched_at
+
+    def history(self, part_key, vendor_key=None, since=None, limit=1000):
+        """依時間排序的價格/庫存紀錄（不含「找不到」的空白紀錄）。"""
+        if not self.path:
+            return []
+        sql = 'SELECT vendor_key, vendor, fetched_at, name, price, stock FROM results WHERE part_key = ? AND name IS NOT NULL'
+        params = [part_key]
+        if vendor_key:
+            sql += ' AND vendor_key = ?'
+            params.append(vendor_key)
+        if since:
+            sql += ' AND fetched_at >= ?'
+            params.append(since)
+        sql += ' ORDER BY fetched_at DESC LIMIT ?'
+        params.append(limit)
+        try:
+            rows = self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            log_event('price_store_read_failed', logging.ERROR, error=repr(e))
+            return []
+        return [
+            {"vendor_key": vendor_key, "vendor": vendor, "fetched_at": fetched_at, "name": name, "price": price, "stock": stock}
+            for vendor_key, vendor, fetched_at, name, price, stock in reversed(rows)
+        ]
+
+    def known_parts(self, limit):
+        """最近有結果的 (料號, 結果名稱, 次數)，作為料號索引的初始資料。"""
+        if not self.path:
+            return []
+        try:
+            return self._connect().execute(
+                'SELECT part_key, name, count FROM parts ORDER BY last_seen DESC LIMIT ?',
+                (limit,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            log_event('price_store_read_failed', logging.ERROR, error=repr(e))
+            return []
 
-    except requests.exceptions.RequestException as e:
-        print(f"RS Components 訪問錯誤: {e}")
-        vendor_results.append({
-            "vendor": "RS Components",
-            "error": f"訪問失敗: {e}"
-        })
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "enabled": bool(self.path),
+            "hits": hits,
+            "misses": misses,
+            "written": self.written,
+            "pending_batches": self._queue.qsize(),
+        }
+
+price_store = PriceStore(PRICE_DB_PATH)
+
+@app.route("/history", methods=['GET'])
+def history():
+    """價格/庫存歷史：/history?part=2273-202&vendor=rs&days=30"""
+    part = request.args.get('part', '')
+    if not part.strip():
+        abort(400)
+    days = request.args.get('days', type=float)
+    since = time.time() - days * 24 * 60 * 60 if days else None
+    return jsonify({
+        "part": normalize_component_name(part),
+        "history": price_store.history(normalize_component_name(part), request.args.get('vendor'), since),
+    })
+
+# --- 料號索引與自動完成 ---
+# 結果名稱中看起來像料號的字：含數字，且有連字號或至少 6 個字元（例如 2273-202、LM358N）
+_PART_TOKEN = re.compile(r'[A-Z0-9][A-Z0-9./-]*[0-9][A-Z0-9./-]*')
+
+def _compact_part(part_key):
+    # 去掉所有分隔符號後比對，'2273-202'、'2273202'、'2273.202' 視為同一個料號
+    return re.sub(r'[^A-Z0-9]', '', part_key)
+
+def _trigrams(compact):
+    padded = f"^{compact}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class PartIndex:
+    """
+    料號索引：以去掉分隔符號的料號為 key，記錄正規化後的料號寫法與出現次數。
+    - resolve：把使用者輸入對應到已知料號（分隔符號不同、前面多了廠牌名稱），找不到時提供相似料號
+    - suggest：自動完成，先找開頭相同的料號，不夠時再以相似度補足
+    前綴查詢使用排序過的 key 與 bisect，相似度查詢先以 trigram 找出候選再計算相似度。
+    """
+    def __init__(self):
+        self._parts = {} # compact -> [正規化料號, 次數]
+        self._sorted = []
+        self._grams = {} # trigram -> set(compact)
+        self._lock = threading.Lock()
+        self._seeded = False
+        self.lookups = {"exact": 0, "alias": 0, "suggested": 0, "unknown": 0, "bypassed": 0}
+
+    def add(self, part_key, names=(), count=1):
+        """加入查詢過且有結果的料號，以及結果名稱中出現的料號。"""
+        tokens = self._tokens(part_key, names)
+        with self._lock:
+            for token in tokens:
+                self._add_locked(token, count)
+
+    @staticmethod
+    def _tokens(part_key, names):
+        tokens = [part_key]
+        for name in names:
+            if not name:
+                continue
+            # 先以空白切開商品名稱再逐字正規化，否則空白會變成連字號，整個名稱被當成一個料號
+            for word in unicodedata.normalize('NFKC', name).split():
+                tokens.extend(
+                    token.strip('-./') for token in _PART_TOKEN.findall(normalize_component_name(word))
+                    if '-' in token or len(token) >= 6
+                )
+        return list(dict.fromkeys(tokens))
+
+    def _add_locked(self, part_key, count=1, keep_sorted=True):
+        compact = _compact_part(part_key)
+        if len(compact) < 3:
+            return
+        entry = self._parts.get(compact)
+        if entry is not None:
+            entry[1] += count
+            return
+        self._parts[compact] = [part_key, count]
+        if keep_sorted:
+            bisect.insort(self._sorted, compact)
+        for gram in _trigrams(compact):
+            self._grams.setdefault(gram, set()).add(compact)
+
+    def seed(self, rows, chunk_size=2000):
+        """
+        載入價格資料庫中的 (料號, 結果名稱, 次數)，由背景執行緒在 worker 啟動時呼叫，不佔用回覆時間。
+        分批取得鎖，每批加入後重新排序一次，不逐筆 insort；載入完成前的查詢只使用目前已有的料號。
+        """
+        for start in range(0, len(rows), chunk_size):
+            chunk = [(self._tokens(part_key, [name]), count) for part_key, name, count in rows[start:start + chunk_size]]
+            with self._lock:
+                for tokens, count in chunk:
+                    for token in tokens:
+                        self._add_locked(token, count, keep_sorted=False)
+                self._sorted = sorted(self._parts)
+        self._seeded = True
+
+    def resolve(self, component_name):
+        """
+        回傳 (已知的正規化料號, 建議清單)。
+        找到已知料號時建議清單為空；不認得時回傳 (None, 相似料號)，沒有相似的則為 (None, [])。
+        """
+        compact = _compact_part(normalize_component_name(component_name))
+        with self._lock:
+            entry = self._parts.get(compact)
+            if entry is not None:
+                self.lookups["exact"] += 1
+                return entry[0], []
+            # 前面多打了廠牌名稱，例如 WAGO2273-202
+            for i in range(1, len(compact) - 3):
+                if not compact[i - 1].isalpha():
+                    break
+                entry = self._parts.get(compact[i:])
+                if entry is not None:
+                    self.lookups["alias"] += 1
+                    return entry[0], []
+        suggestions = self.similar(compact)
+        with self._lock:
+            self.lookups["suggested" if suggestions else "unknown"] += 1
+        return None, suggestions
+
+    def similar(self, compact, limit=3, min_score=None):
+        """以 trigram 找出候選，再依相似度（相同時依出現次數）排序。"""
+        if min_score is None:
+            min_score = PART_SUGGEST_MIN_SCORE
+        grams = _trigrams(compact)
+        with self._lock:
+            shared = {}
+            for gram in grams:
+                for candidate in self._grams.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            candidates = sorted(shared, key=shared.get, reverse=True)[:50]
+            entries = {candidate: tuple(self._parts[candidate]) for candidate in candidates}
+        scored = []
+        for candidate, (part_key, count) in entries.items():
+            score = difflib.SequenceMatcher(None, compact, candidate).ratio()
+            if score >= min_score:
+                scored.append((score, count, part_key))
+        scored.sort(reverse=True)
+        return [part_key for _, _, part_key in scored[:limit]]
+
+    def suggest(self, prefix, limit=10):
+        """自動完成：開頭相同的料號依出現次數排序，不足 limit 個時以相似的料號補足。"""
+        compact = _compact_part(normalize_component_name(prefix))
+        if not compact:
+            return []
+        with self._lock:
+            matches = []
+            for i in range(bisect.bisect_left(self._sorted, compact), len(self._sorted)):
+                candidate = self._sorted[i]
+                if not candidate.startswith(compact) or len(matches) >= 500:
+                    break
+                matches.append(tuple(self._parts[candidate]))
+        matches.sort(key=lambda entry: (-entry[1], entry[0]))
+        results = [part_key for part_key, _ in matches[:limit]]
+        if len(results) < limit:
+            for part_key in self.similar(compact, limit, min_score=0.6):
+                if part_key not in results:
+                    results.append(part_key)
+        return results[:limit]
+
+    def count_lookup(self, kind):
+        with self._lock:
+            self.lookups[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._parts), "seeded": self._seeded, "lookups": dict(self.lookups)}
+
+part_index = PartIndex()
+_part_index_thread = None
+_part_index_lock = threading.Lock()
+
+def _seed_part_index():
+    started = time.perf_counter()
+    try:
+        part_index.seed(price_store.known_parts(PART_INDEX_SEED_LIMIT))
     except Exception as e:
-        print(f"RS Components 解析錯誤: {e}")
-        vendor_results.append({
-            "vendor": "RS Components",
-            "error": "頁面解析失敗，可能網站結構有變。"
-        })
-    
-    return vendor_results
-
-def scrape_wago(component_name, headers): # <--- 已修改
-    vendor_results = []
-    search_url = f"https://www.wago.com/tw/search?query={component_name}"
-
+        log_event('part_index_seed_failed', logging.WARNING, error=repr(e))
+        return
+    log_event('part_index_seeded', entries=part_index.stats()["entries"],
+              ms=round((time.perf_counter() - started) * 1000, 1))
+
+def _ensure_part_index_seeder():
+    global _part_index_thread
+    if not PART_INDEX_ENABLED or _part_index_thread is not None:
+        return
+    with _part_index_lock:
+        if _part_index_thread is None:
+            _part_index_thread = threading.Thread(target=_seed_part_index, name='part-index-seed', daemon=True)
+            _part_index_thread.start()
+
+@app.route("/suggest", methods=['GET'])
+def suggest():
+    """料號自動完成：/suggest?q=2273-2&limit=10"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({"query": query, "suggestions": part_index.suggest(query, limit) if query.strip() else []})
+
+# --- 相同查詢合併（single-flight） ---
+class SingleFlight:
+    """
+    同一個 key 同時只執行一次 fn，其他同時呼叫的執行緒等待並取得相同的結果（或例外）。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+search_flight = SingleFlight()
+vendor_flight = SingleFlight()
+_cross_process_stats = {"shared": 0}
+_flight_sweep_lock = threading.Lock()
+_flight_swept_at = 0.0
+
+def run_cross_process(key, fn, deadline=None, encode=None, decode=None):
+    """
+    透過檔案鎖讓同一台機器上的 gunicorn worker 合併相同的查詢：
+    拿到鎖的 worker 執行 fn 並把結果寫成 JSON 檔，其他 worker 等鎖釋放後直接讀取結果。
+    fn 的回傳值（經過 encode 之後）必須可以轉成 JSON；讀取其他 worker 的結果時以 decode 還原。
+    """
+    if fcntl is None or not SINGLE_FLIGHT_DIR:
+        return fn()
+    os.makedirs(SINGLE_FLIGHT_DIR, exist_ok=True)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    lock_path = os.path.join(SINGLE_FLIGHT_DIR, digest + '.lock')
+    result_path = os.path.join(SINGLE_FLIGHT_DIR, digest + '.json')
+    started = time.time()
+    if deadline is None:
+        deadline = time.monotonic() + SEARCH_DEADLINE_SECONDS
+
+    lock_file = _lock_flight_file(lock_path, deadline)
+    if lock_file is None:
+        # 等太久了就自己查（fn 會自行處理已超過截止時間的情況）
+        return fn()
+    with lock_file:
+        try:
+            # 其他 worker 剛完成（或我們等待期間完成）的結果直接沿用
+            shared = _read_fresh_result(result_path, started - SINGLE_FLIGHT_REUSE_SECONDS)
+            if shared is not None:
+                _cross_process_stats["shared"] += 1
+                return decode(shared) if decode else shared
+
+            result = fn()
+            tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(encode(result) if encode else result, f, ensure_ascii=False)
+            os.replace(tmp_path, result_path)
+            return result
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            sweep_single_flight_dir()
+
+def _lock_flight_file(lock_path, deadline):
+    """
+    取得查詢專屬鎖檔的獨占鎖，回傳開啟中的檔案；超過 deadline 仍拿不到時回傳 None。
+    清理程式會在持有鎖時刪除過期的鎖檔，所以拿到鎖後要確認路徑仍指向同一個檔案，否則重新開啟。
+    """
+    while True:
+        lock_file = open(lock_path, 'a')
+        try:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        lock_file.close()
+                        return None
+                    time.sleep(0.05)
+            try:
+                current = os.stat(lock_path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(lock_file.fileno()).st_ino:
+                # 更新修改時間，清理程式以此判斷鎖檔是否還在使用
+                os.utime(lock_path)
+                return lock_file
+        except BaseException:
+            lock_file.close()
+            raise
+        lock_file.close()
+
+def sweep_single_flight_dir(now=None):
+    """
+    刪除 SINGLE_FLIGHT_DIR 中已經不會再被沿用的鎖檔與結果檔（每個 process 每 SINGLE_FLIGHT_SWEEP_SECONDS 秒最多一次）。
+    等鎖的 worker 最多等 SEARCH_DEADLINE_SECONDS，所以多保留這段時間，避免刪掉它們還能用的結果。
+    鎖檔只在拿得到鎖（沒有 worker 正在查詢）時刪除。
+    """
+    global _flight_swept_at
+    now = time.time() if now is None else now
+    with _flight_sweep_lock:
+        if now - _flight_swept_at < SINGLE_FLIGHT_SWEEP_SECONDS:
+            return 0
+        _flight_swept_at = now
+    cutoff = now - SINGLE_FLIGHT_REUSE_SECONDS - SEARCH_DEADLINE_SECONDS
+    removed = 0
     try:
-        response = requests.get(search_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        product_cards = soup.find_all('div', class_='product-list__item') 
-        
-        if not product_cards:
-            print(f"WAGO: 未找到 '{component_name}' 相關結果。")
-            return []
-
-        for card in product_cards[:3]:
-            title_tag = card.find('h3', class_='product-list__item-title')
-            link_tag = card.find('a', class_='product-list__item-link')
-
-            if title_tag and link_tag:
-                title = title_tag.get_text(strip=True)
-                link = "https://www.wago.com" + link_tag['href']
-                
-                vendor_results.append({
-                    "vendor": "WAGO",
-                    "name": title,
-                    "link": link,
-                    "price": "製造商網站通常不提供價格",
-                    "stock": "製造商網站通常不提供庫存"
-                })
+        entries = list(os.scandir(SINGLE_FLIGHT_DIR))
+    except OSError:
+        return 0
+    for entry in entries:
+        name = entry.name
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if name.endswith('.lock'):
+                removed += _remove_idle_lock(entry.path, cutoff)
+            elif '.json' in name:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            # 其他 worker 剛好刪掉或正在改寫，下次再處理
+            continue
+    if removed:
+        log_event('single_flight_swept', removed=removed)
+    return removed
+
+def _remove_idle_lock(lock_path, cutoff):
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        # 拿到鎖之前可能有 worker 剛用完並更新了修改時間，或其他 process 已經刪掉並重建了鎖檔
+        opened = os.fstat(lock_file.fileno())
+        if opened.st_mtime >= cutoff or os.stat(lock_path).st_ino != opened.st_ino:
+            return 0
+        os.remove(lock_path)
+        return 1
+
+def _read_fresh_result(path, not_before):
+    try:
+        if os.path.getmtime(path) < not_before:
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# --- 廠商健康狀態 / 斷路器 ---
+class VendorHealth:
+    """
+    追蹤單一廠商最近的請求結果與延遲：
+    - closed：正常查詢
+    - open：錯誤率或反爬蟲比例過高，冷卻期間直接略過
+    - half_open：冷卻結束，只放一個試探請求，成功就恢復，失敗就再冷卻一次
+    """
+    def __init__(self, key):
+        self.key = key
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._recent = deque() # (時間, 結果, 延遲秒數)
+        self._buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_SECONDS:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, outcome, latency):
+        """outcome 為 ok / captcha / timeout / error 其中之一。"""
+        now = time.monotonic()
+        vendor_requests.inc(vendor=self.key, outcome=outcome)
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+            self._buckets[_bucket_index(latency)] += 1
+            self._recent.append((now, outcome, latency))
+            self._trim(now)
+
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+                if outcome == 'ok':
+                    log_event('breaker_closed', logging.WARNING, vendor=self.key)
+                    self.state = 'closed'
+                    self._recent.clear()
+                else:
+                    self._open(now)
+                return
+
+            if self.state == 'closed' and len(self._recent) >= BREAKER_MIN_REQUESTS:
+                error_rate, captcha_rate = self._rates()
+                if error_rate >= BREAKER_ERROR_RATE or captcha_rate >= BREAKER_CAPTCHA_RATE:
+                    log_event('breaker_open', logging.WARNING, vendor=self.key, error_rate=round(error_rate, 3),
+                              captcha_rate=round(captcha_rate, 3), cooldown=BREAKER_COOLDOWN_SECONDS)
+                    self._open(now)
+
+    def release_probe(self):
+        """試探請求沒有真的送出（例如被限速略過）時，讓下一個請求可以接著試探。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def timeout_for(self, max_timeout):
+        """依最近成功請求的 p95 延遲決定 timeout；樣本不足時使用廠商設定的 timeout。"""
+        with self._lock:
+            self._trim(time.monotonic())
+            latencies = sorted(latency for _, outcome, latency in self._recent if outcome == 'ok')
+        if len(latencies) < BREAKER_MIN_REQUESTS:
+            return max_timeout
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return min(max_timeout, max(ADAPTIVE_TIMEOUT_MIN, p95 * ADAPTIVE_TIMEOUT_FACTOR))
+
+    def _open(self, now):
+        self.state = 'open'
+        self.opened_at = now
+        self.trips += 1
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0][0] > HEALTH_WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def _rates(self):
+        total = len(self._recent)
+        if not total:
+            return 0.0, 0.0
+        errors = sum(1 for _, outcome, _ in self._recent if outcome != 'ok')
+        captchas = sum(1 for _, outcome, _ in self._recent if outcome == 'captcha')
+        return errors / total, captchas / total
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            error_rate, captcha_rate = self._rates()
+            latencies = [latency for _, outcome, latency in self._recent if outcome == 'ok']
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "recent_requests": len(self._recent),
+                "error_rate": round(error_rate, 3),
+                "captcha_rate": round(captcha_rate, 3),
+                "latency_p95": round(_summarize(latencies).get("p95", 0.0), 3),
+                "outcomes": dict(self._outcomes),
+                "latency_histogram": {
+                    (f"le_{bound}" if i < len(LATENCY_BUCKETS) else "inf"): count
+                    for i, (bound, count) in enumerate(zip(LATENCY_BUCKETS + (None,), self._buckets))
+                },
+            }
+
+def _bucket_index(latency):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if latency <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+vendor_health = {}
+_vendor_health_lock = threading.Lock()
+
+def get_vendor_health(key):
+    health = vendor_health.get(key)
+    if health is None:
+        with _vendor_health_lock:
+            health = vendor_health.setdefault(key, VendorHealth(key))
+    return health
+
+# --- 查詢結果 ---
+class ResultStatus(IntEnum):
+    """查詢結果的狀態，對應的錯誤訊息由 VendorResult.error 在輸出時才產生。"""
+    OK = 0
+    TIMEOUT = 1 # 超過整體查詢的截止時間
+    FAILED = 2 # 未預期的例外
+    CIRCUIT_OPEN = 3 # 斷路器開啟，暫時略過
+    RATE_LIMITED = 4 # 等不到請求額度，暫時略過
+    CAPTCHA = 5
+    NOT_FOUND = 6
+    REQUEST_FAILED = 7 # 連線失敗或 HTTP 錯誤，detail 為錯誤內容
+    PARSE_ERROR = 8
+    MANUAL = 9 # 需要使用者自行查閱（KSS 型錄索引尚未建立）
+
+# 略過的結果不快取，冷卻結束或額度恢復後就能馬上重試
+_SKIPPED_STATUSES = frozenset({ResultStatus.TIMEOUT, ResultStatus.CIRCUIT_OPEN, ResultStatus.RATE_LIMITED})
+_STATUS_TEXT = {
+    ResultStatus.TIMEOUT: "查詢逾時，請稍後再試。",
+    ResultStatus.FAILED: "查詢失敗，請稍後再試。",
+    ResultStatus.CIRCUIT_OPEN: "該網站近期連線異常，暫時略過，稍後會自動重試。",
+    ResultStatus.RATE_LIMITED: "查詢量較大，暫時略過這個網站，請稍後再試。",
+    ResultStatus.CAPTCHA: "可能遇到反爬蟲機制，請嘗試手動訪問或稍後再試。",
+    ResultStatus.NOT_FOUND: "未找到產品結果。",
+    ResultStatus.PARSE_ERROR: "頁面解析失敗，可能網站結構有變。",
+    ResultStatus.MANUAL: "需手動查閱 PDF 型錄，自動化查詢困難。",
+}
+# 這些狀態優先使用廠商設定中的訊息
+_VENDOR_STATUS_TEXT = {
+    ResultStatus.CAPTCHA: 'captcha_error',
+    ResultStatus.NOT_FOUND: 'not_found_error',
+    ResultStatus.PARSE_ERROR: 'parse_error',
+}
+# 不是由廠商設定產生的結果，欄位沒有值時顯示的文字
+_EXTRA_PLACEHOLDERS = {
+    "KSS": {"price": "型錄未列價格", "stock": "請洽 KSS 經銷商"},
+}
+_RESULT_FIELDS = ('name', 'link', 'price', 'stock')
+
+@dataclass(slots=True)
+class VendorResult:
+    """
+    一個廠商的一筆查詢結果（或錯誤）。快取、資料庫與各回覆方式之間傳遞的都是這個物件：
+    以 __slots__ 存放、廠商名稱經過 sys.intern，狀態為整數，沒有值的欄位存 None。
+    錯誤訊息與欄位的預設文字（例如「製造商網站通常不提供價格」）由 error / text() 在輸出時才產生，
+    每筆結果不必各自帶著一段說明文字。to_dict() 輸出與改版前相同格式的 dict（JSON 用）。
+    """
+    vendor: str
+    status: ResultStatus = ResultStatus.OK
+    name: Optional[str] = None
+    link: Optional[str] = None
+    price: Optional[str] = None
+    stock: Optional[str] = None
+    fetched_at: Optional[float] = None
+    detail: Optional[str] = None
+    extra: Optional[Dict[str, str]] = None # 廠商設定中 name/link/price/stock 以外的欄位
+
+    def __post_init__(self):
+        self.vendor = sys.intern(self.vendor)
+
+    @property
+    def ok(self):
+        return self.status == ResultStatus.OK
+
+    @property
+    def skipped(self):
+        return self.status in _SKIPPED_STATUSES
+
+    @property
+    def error(self):
+        if self.status == ResultStatus.OK:
+            return None
+        if self.status == ResultStatus.REQUEST_FAILED:
+            return f"訪問失敗: {self.detail}"
+        attr = _VENDOR_STATUS_TEXT.get(self.status)
+        vendor = _VENDORS_BY_NAME.get(self.vendor) if attr else None
+        return (getattr(vendor, attr) if vendor else None) or _STATUS_TEXT[self.status]
+
+    def _value(self, field):
+        return getattr(self, field) if field in _RESULT_FIELDS else (self.extra or {}).get(field)
+
+    def text(self, field):
+        """欄位的顯示文字：沒有值時依序使用廠商欄位設定的 default、_EXTRA_PLACEHOLDERS、N/A。"""
+        value = self._value(field)
+        if value is not None:
+            return value
+        vendor = _VENDORS_BY_NAME.get(self.vendor)
+        if vendor is not None and field in vendor.fields:
+            return vendor.fields[field].default
+        return _EXTRA_PLACEHOLDERS.get(self.vendor, {}).get(field, 'N/A')
+
+    def to_dict(self, placeholders=True):
+        """
+        錯誤為 {vendor, status, error}（略過的加上 skipped），正常結果為 {vendor, status, 各欄位}。
+        placeholders 為 False 時省略沒有值的欄位，給 from_dict 還原用。
+        """
+        item = {"vendor": self.vendor, "status": int(self.status)}
+        if not self.ok:
+            item["error"] = self.error
+            if self.detail is not None:
+                item["detail"] = self.detail
+            if self.skipped:
+                item["skipped"] = True
+            for field in ('name', 'link'):
+                if self._value(field) is not None:
+                    item[field] = self._value(field)
+            return item
+        for field in _RESULT_FIELDS + tuple(self.extra or ()):
+            value = self.text(field) if placeholders else self._value(field)
+            if value is not None:
+                item[field] = value
+        if self.fetched_at is not None:
+            item["fetched_at"] = self.fetched_at
+        return item
+
+    @classmethod
+    def from_dict(cls, item):
+        status = ResultStatus(item.get("status", ResultStatus.FAILED if "error" in item else ResultStatus.OK))
+        if status != ResultStatus.OK:
+            return cls(item.get("vendor", ""), status, item.get("name"), item.get("link"), detail=item.get("detail"))
+        extra = {key: value for key, value in item.items() if key not in _DICT_KEYS}
+        return cls(
+            item["vendor"], status, item.get("name"), item.get("link"), item.get("price"), item.get("stock"),
+            item.get("fetched_at"), extra=extra or None,
+        )
+
+_DICT_KEYS = frozenset(("vendor", "status") + _RESULT_FIELDS + ("fetched_at",))
+
+# --- 廠商爬蟲設定 ---
+# 每個廠商以宣告方式描述：搜尋網址、結果列的 CSS Selector、各欄位的 Selector、
+# 反爬蟲判斷字串與 timeout，由同一個 run_vendor_scraper 執行。
+# 請再次注意：以下的 CSS Selector 都是範例，
+# 您必須實際訪問網站，按 F12 檢查其 HTML 結構來獲取正確的 Selector。
 
-    except requests.exceptions.RequestException as e:
-        print(f"WAGO 訪問錯誤: {e}")
-        vendor_results.append({
-            "vendor": "WAGO",
-            "error": f"訪問失敗: {e}"
-        })
-    except Exception as e:
-        print(f"WAGO 解析錯誤: {e}")
-        vendor_results.append({
-            "vendor": "WAGO",
-            "error": "頁面解析失敗，可能網站結構有變。"
-        })
-    
-    return vendor_results
+@dataclass
+class FieldSpec:
+    """
+    單一欄位的擷取方式。selector 為 None 時直接使用 default（例如製造商網站固定的說明文字）。
+    attr 有值時取該屬性（例如 href），否則取文字；prefix 會加在結果前面（例如補上網域）。
+    default 不會存進結果，由 VendorResult.text() 在輸出時補上。
+    """
+    selector: Optional[str] = None
+    attr: Optional[str] = None
+    prefix: str = ''
+    required: bool = False
+    default: str = '無資訊'
+
+    def __post_init__(self):
+        self._compiled = soupsieve.compile(self.selector) if self.selector else None
+
+    def extract(self, row):
+        """回傳擷取到的文字，找不到時回傳 None（required 的欄位找不到時整筆結果列不使用）。"""
+        if self._compiled is None:
+            return None
+        tag = self._compiled.select_one(row)
+        if tag is None:
+            return None
+        if self.attr:
+            value = tag.get(self.attr)
+            return None if value is None else self.prefix + value
+        return self.prefix + tag.get_text(strip=True)
+
+@dataclass
+class VendorScraper:
+    """
+    一個廠商的爬蟲設定。url_template 中的 {query} 會被替換成料號。
+    not_found_error 為 None 時，找不到結果就回傳空 list（不顯示在回覆中）。
+    """
+    key: str
+    name: str
+    url_template: str
+    row_selector: str
+    fields: Dict[str, FieldSpec]
+    timeout: float = 10
+    max_rows: int = 3
+    captcha_markers: Tuple[str, ...] = ()
+    captcha_url_markers: Tuple[str, ...] = ()
+    captcha_error: str = "可能遇到反爬蟲機制，請嘗試手動訪問或稍後再試。"
+    not_found_error: Optional[str] = None
+    parse_error: str = "頁面解析失敗，可能網站結構有變。"
+    cache_ttl: float = DEFAULT_CACHE_TTL
+    enabled: bool = True
+    # 請求頻率（每秒請求數）與最多連續請求數，None 時使用 HOST_RATE / HOST_BURST
+    rate: Optional[float] = None
+    burst: Optional[float] = None
+
+    def __post_init__(self):
+        self._row_selector = soupsieve.compile(self.row_selector)
+        # row_selector 是簡單的 "tag.class" 形式時，可以只解析結果列的部分，
+        # 並在第 max_rows + 1 筆結果列開始的位置直接截斷頁面
+        self._strainer = None
+        self._row_start = None
+        match = _SIMPLE_SELECTOR.match(self.row_selector)
+        if match:
+            tag, classes = match.group(1), match.group(2).split('.')[1:]
+            self._strainer = SoupStrainer(tag, class_=_class_matcher(classes[-1]))
+            # 開始標籤的 class 必須包含所有指定的 class，才算一筆結果列
+            has_classes = ''.join(
+                r'(?=[^"\']*(?<![\w-])%s(?![\w-]))' % re.escape(name) for name in classes
+            )
+            self._row_start = re.compile(
+                r'<%s\b[^>]*\bclass\s*=\s*["\']%s' % (tag, has_classes),
+                re.IGNORECASE,
+            )
+
+    def search_url(self, component_name):
+        return self.url_template.format(query=quote_plus(component_name))
+
+    def is_captcha(self, url, text):
+        url = url.lower()
+        if any(marker in url for marker in self.captcha_url_markers):
+            return True
+        if self.captcha_markers:
+            text = text.lower()
+            return any(marker in text for marker in self.captcha_markers)
+        return False
+
+    def parse_page(self, text):
+        """
+        只解析需要的部分：截掉前 max_rows 筆結果列之後的內容，
+        再以 SoupStrainer 只建立結果列的子樹。用完後應呼叫 soup.decompose() 釋放。
+        """
+        if self._row_start is not None:
+            for count, match in enumerate(self._row_start.finditer(text)):
+                if count == self.max_rows:
+                    text = text[:match.start()]
+                    break
+        return BeautifulSoup(text, HTML_PARSER, parse_only=self._strainer)
+
+    def select_rows(self, soup):
+        return self._row_selector.select(soup, limit=self.max_rows)
+
+    def parse_rows(self, text):
+        return self.select_rows(self.parse_page(text))
+
+    @classmethod
+    def from_config(cls, config):
+        config = dict(config)
+        config['fields'] = {
+            name: spec if isinstance(spec, FieldSpec) else FieldSpec(**spec)
+            for name, spec in config.get('fields', {}).items()
+        }
+        for name in ('captcha_markers', 'captcha_url_markers'):
+            if name in config:
+                config[name] = tuple(config[name])
+        return cls(**config)
+
+_SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][\w-]*)((?:\.[\w-]+)+)$')
+
+def _class_matcher(class_name):
+    # 解析途中 class 屬性還是完整字串（例如 "x product-row"），需要自行拆開比對
+    def matches(value):
+        if not value:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return class_name in value
+    return matches
+
+DEFAULT_VENDORS = [
+    VendorScraper(
+        key="rs",
+        name="RS Components",
+        url_template="https://twcn.rs-online.com/web/search/searchBrowseAction.html?sra=grp&searchTerm={query}",
+        row_selector="tr.product-row",
+        fields={
+            "name": FieldSpec("a.description-link", required=True),
+            "link": FieldSpec("a.description-link", attr="href", prefix="https://twcn.rs-online.com", required=True),
+            "price": FieldSpec("span.price", required=True),
+            "stock": FieldSpec("span.stock-value"),
+        },
+        timeout=10,
+        cache_ttl=15 * 60,
+    ),
+    VendorScraper(
+        key="wago",
+        name="WAGO",
+        url_template="https://www.wago.com/tw/search?query={query}",
+        row_selector="div.product-list__item",
+        fields={
+            "name": FieldSpec("h3.product-list__item-title", required=True),
+            "link": FieldSpec("a.product-list__item-link", attr="href", prefix="https://www.wago.com", required=True),
+            "price": FieldSpec(default="製造商網站通常不提供價格"),
+            "stock": FieldSpec(default="製造商網站通常不提供庫存"),
+        },
+        timeout=10,
+        cache_ttl=24 * 60 * 60, # 型錄資料幾乎不會變
+    ),
+    VendorScraper(
+        key="digikey",
+        name="Digi-Key",
+        url_template="https://www.digikey.tw/zh/products/search?keywords={query}",
+        row_selector="div.MuiGrid-root.MuiGrid-item.MuiGrid-grid-xs-12.MuiGrid-grid-sm-6.MuiGrid-grid-md-4.MuiGrid-grid-lg-3",
+        fields={
+            "name": FieldSpec("a.MuiTypography-root.MuiLink-root.MuiLink-underlineNone.MuiTypography-body1", required=True),
+            "link": FieldSpec("a.MuiTypography-root.MuiLink-root.MuiLink-underlineNone.MuiTypography-body1", attr="href", prefix="https://www.digikey.tw", required=True),
+            "price": FieldSpec("span.MuiTypography-root.MuiTypography-body1.MuiTypography-noWrap", required=True),
+            "stock": FieldSpec("p.MuiTypography-root.MuiTypography-body2.MuiTypography-colorTextSecondary", required=True),
+        },
+        timeout=15,
+        captcha_markers=("captcha",),
+        captcha_url_markers=("recaptcha",),
+        not_found_error="未找到產品結果，可能網頁結構有變或無相關產品。",
+        parse_error="頁面解析失敗，可能網站結構有變或選擇器錯誤。",
+        cache_ttl=10 * 60,
+    ),
+    VendorScraper(
+        key="mouser",
+        name="Mouser",
+        url_template="https://www.mouser.tw/Search/Refine?Keyword={query}",
+        row_selector="tr.searchResultsRow",
+        fields={
+            "name": FieldSpec("a.MfrPartLink", required=True),
+            "link": FieldSpec("a.MfrPartLink", attr="href", prefix="https://www.mouser.tw", required=True),
+            "price": FieldSpec("td.pricing span.pricing-value"),
+            "stock": FieldSpec("div.availableStock"),
+        },
+        timeout=15,
+        captcha_markers=("captcha",),
+        captcha_url_markers=("verify",),
+        not_found_error="未找到產品結果，可能網頁結構有變或無相關產品。",
+        parse_error="頁面解析失敗，可能網站結構有變或選擇器錯誤。",
+        cache_ttl=10 * 60,
+    ),
+    VendorScraper(
+        key="octopart",
+        name="Octopart",
+        url_template="https://octopart.com/search?q={query}",
+        # 以下選擇器是假設內容在原始 HTML 中可見
+        row_selector="div.ProductSearch_ProductSummaryCard__vjM4O",
+        fields={
+            "name": FieldSpec("a.ProductSummaryCard_productLink__aD4sE", required=True),
+            "link": FieldSpec("a.ProductSummaryCard_productLink__aD4sE", attr="href", prefix="https://octopart.com", required=True),
+            # 以下價格/庫存的選擇器需要您仔細觀察 Octopart 頁面來填寫
+            "price": FieldSpec("span.ProductSummaryCard_price__some_hash"),
+            "stock": FieldSpec("span.ProductSummaryCard_stock__some_hash"),
+        },
+        timeout=20,
+        not_found_error="未找到產品結果，可能內容動態載入或結構有變，請考慮使用進階爬蟲或 API。",
+        parse_error="頁面解析失敗，可能網站結構有變或選擇器錯誤，或內容為JS動態載入。",
+        cache_ttl=30 * 60,
+    ),
+]
 
-def scrape_digikey(component_name, headers): # <--- 已修改
+def load_vendor_registry(config_path=None, disabled=()):
+    """
+    建立廠商清單。config_path 指向的 JSON 檔（一個 list）可以覆寫既有廠商的設定
+    （以 key 對應，例如 {"key": "octopart", "enabled": false}），
+    或是加入新的廠商（需提供完整設定）。disabled 中的 key 會被停用。
+    """
+    registry = OrderedDict((vendor.key, vendor) for vendor in DEFAULT_VENDORS)
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            for config in json.load(f):
+                if config['key'] in registry:
+                    current = registry[config['key']]
+                    merged = {field_def.name: getattr(current, field_def.name) for field_def in dataclass_fields(VendorScraper)}
+                    merged.update(config)
+                    registry[config['key']] = VendorScraper.from_config(merged)
+                else:
+                    registry[config['key']] = VendorScraper.from_config(config)
+    for key in disabled:
+        if key in registry:
+            registry[key] = replace(registry[key], enabled=False)
+    return registry
+
+VENDOR_REGISTRY = load_vendor_registry(
+    os.getenv('VENDOR_CONFIG_PATH'),
+    [key.strip() for key in os.getenv('DISABLED_VENDORS', '').split(',') if key.strip()],
+)
+
+_VENDOR_HOSTS = {urlsplit(vendor.search_url('')).hostname: vendor for vendor in VENDOR_REGISTRY.values()}
+# VendorResult 只記錄廠商名稱，輸出時依名稱找回廠商設定中的訊息與欄位預設文字
+_VENDORS_BY_NAME = {vendor.name: vendor for vendor in VENDOR_REGISTRY.values()}
+
+def enabled_vendors():
+    return [vendor for vendor in VENDOR_REGISTRY.values() if vendor.enabled]
+
+def run_vendor_scraper(vendor, component_name, headers, deadline=None):
+    """
+    所有廠商共用的爬蟲流程：組網址、下載、檢查反爬蟲、找出結果列、擷取前幾筆的欄位。
+    deadline（time.monotonic() 的時間點）為整體查詢的截止時間，timeout 不會超過剩餘的時間。
+    下載的內容解碼後就不再保留，解析樹在擷取完欄位後馬上拆除，同時查詢很多料號時不會堆積。
+    """
     vendor_results = []
-    search_url = f"https://www.digikey.tw/zh/products/search?keywords={component_name}"
-
-    print(f"正在搜尋 Digi-Key for {component_name}...")
-
+    search_url = vendor.search_url(component_name)
+    health = get_vendor_health(vendor.key)
+
+    vendor_timeout = health.timeout_for(vendor.timeout)
+    timeout = vendor_timeout
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+    if timeout <= 0:
+        return [VendorResult(vendor.name, ResultStatus.TIMEOUT)]
+    if not health.allow_request():
+        vendor_requests.inc(vendor=vendor.key, outcome='skipped')
+        log_event('vendor_skipped', sampled=True, vendor=vendor.key, state=health.state)
+        return [VendorResult(vendor.name, ResultStatus.CIRCUIT_OPEN)]
+
+    fetch_started = time.monotonic()
+    fetch_recorded = False
+    cut_short = False
     try:
-        response = requests.get(search_url, headers=headers, timeout=15)
-        response.raise_for_status() 
-
-        if "recaptcha" in response.url or "captcha" in response.text.lower():
-            print(f"Digi-Key: 可能遇到反爬蟲機制，需要手動驗證。")
-            vendor_results.append({
-                "vendor": "Digi-Key",
-                "error": "可能遇到反爬蟲機制，請嘗試手動訪問或稍後再試。"
-            })
-            return vendor_results
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # --- **重要：這部分需要根據您 F12 觀察到的實際 HTML 結構修改** ---
-        product_items = soup.find_all('div', class_='MuiGrid-root MuiGrid-item MuiGrid-grid-xs-12 MuiGrid-grid-sm-6 MuiGrid-grid-md-4 MuiGrid-grid-lg-3') 
-        
-        if not product_items:
-            print(f"Digi-Key: 未找到 '{component_name}' 相關產品項目，檢查選擇器或結果頁面。")
-            vendor_results.append({
-                "vendor": "Digi-Key",
-                "error": "未找到產品結果，可能網頁結構有變或無相關產品。"
-            })
+        with stage_timer('fetch', vendor.key):
+            # 廠商的回應時間從拿到請求額度、實際送出請求時開始計算，不含等待額度的時間
+            request_timeout = throttle_request(search_url, timeout, vendor.key, deadline)
+            cut_short = request_timeout < vendor_timeout
+            fetch_started = time.monotonic()
+            response = fetch_page(search_url, headers, timeout=request_timeout, vendor_key=vendor.key, throttle=False)
+            response.raise_for_status()
+            response_url, text = response.url, decode_body(response)
+            del response # 之後只使用解碼後的文字，原始內容可以先釋放
+
+        if vendor.is_captcha(response_url, text):
+            health.record('captcha', time.monotonic() - fetch_started)
+            log_event('vendor_captcha', logging.WARNING, vendor=vendor.key, url=response_url)
+            vendor_results.append(VendorResult(vendor.name, ResultStatus.CAPTCHA))
             return vendor_results
-
-        for item in product_items[:3]:
-            title_tag = item.find('a', class_='MuiTypography-root MuiLink-root MuiLink-underlineNone MuiTypography-body1')
-            price_tag = item.find('span', class_='MuiTypography-root MuiTypography-body1 MuiTypography-noWrap')
-            stock_tag = item.find('p', class_='MuiTypography-root MuiTypography-body2 MuiTypography-colorTextSecondary')
-
-            if title_tag and price_tag and stock_tag:
-                title = title_tag.get_text(strip=True)
-                link = "https://www.digikey.tw" + title_tag['href']
-                price = price_tag.get_text(strip=True)
-                stock = stock_tag.get_text(strip=True)
-
-                vendor_results.append({
-                    "vendor": "Digi-Key",
-                    "name": title,
-                    "link": link,
-                    "price": price,
-                    "stock": stock
-                })
-            else:
-                print(f"Digi-Key: 某些產品資訊（標題/價格/庫存）未找到，檢查選擇器。")
-                
+        health.record('ok', time.monotonic() - fetch_started)
+        fetch_recorded = True
+
+        with stage_timer('parse', vendor.key):
+            soup = vendor.parse_page(text)
+            del text
+            rows = vendor.select_rows(soup)
+
+        try:
+            if not rows:
+                log_event('vendor_not_found', sampled=True, vendor=vendor.key, part=component_name)
+                if vendor.not_found_error:
+                    vendor_results.append(VendorResult(vendor.name, ResultStatus.NOT_FOUND))
+                return vendor_results
+
+            with stage_timer('extract', vendor.key):
+                for row in rows:
+                    values = {}
+                    for field_name, field_spec in vendor.fields.items():
+                        value = field_spec.extract(row)
+                        if value is None and field_spec.required:
+                            log_event('vendor_field_missing', logging.WARNING, vendor=vendor.key, field=field_name)
+                            break
+                        values[field_name] = value
+                    else:
+                        extra = {name: values.pop(name) for name in list(values) if name not in _RESULT_FIELDS}
+                        vendor_results.append(VendorResult(vendor.name, extra=extra or None, **values))
+        finally:
+            # BeautifulSoup 的節點彼此循環參照，不拆除的話要等到 GC 才會釋放整棵樹
+            soup.decompose()
+
+    except RateLimitExceeded as e:
+        # 請求沒有送出，不算在廠商的健康狀態裡，也不快取
+        health.release_probe()
+        vendor_requests.inc(vendor=vendor.key, outcome='rate_limited')
+        log_event('vendor_rate_limited', logging.WARNING, vendor=vendor.key, error=str(e))
+        return [VendorResult(vendor.name, ResultStatus.RATE_LIMITED)]
+    except requests.exceptions.Timeout as e:
+        if cut_short:
+            # timeout 被整體查詢的截止時間縮短，不代表廠商變慢，不記錄到健康狀態（避免自己的負載讓斷路器跳開）
+            health.release_probe()
+            vendor_requests.inc(vendor=vendor.key, outcome='deadline')
+            log_event('vendor_deadline_timeout', sampled=True, vendor=vendor.key, error=repr(e))
+            return [VendorResult(vendor.name, ResultStatus.TIMEOUT)]
+        health.record('timeout', time.monotonic() - fetch_started)
+        log_event('vendor_request_failed', logging.WARNING, vendor=vendor.key, outcome='timeout', error=repr(e))
+        vendor_results.append(VendorResult(vendor.name, ResultStatus.REQUEST_FAILED, detail=str(e)))
     except requests.exceptions.RequestException as e:
-        print(f"Digi-Key 訪問錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Digi-Key",
-            "error": f"訪問失敗: {e}"
-        })
+        outcome = 'error'
+        health.record(outcome, time.monotonic() - fetch_started)
+        log_event('vendor_request_failed', logging.WARNING, vendor=vendor.key, outcome=outcome, error=repr(e))
+        vendor_results.append(VendorResult(vendor.name, ResultStatus.REQUEST_FAILED, detail=str(e)))
     except Exception as e:
-        print(f"Digi-Key 解析錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Digi-Key",
-            "error": "頁面解析失敗，可能網站結構有變或選擇器錯誤。"
-        })
-    
-    return vendor_results
+        if not fetch_recorded:
+            health.record('error', time.monotonic() - fetch_started)
+        log_event('vendor_parse_failed', logging.ERROR, vendor=vendor.key, error=repr(e))
+        vendor_results.append(VendorResult(vendor.name, ResultStatus.PARSE_ERROR))
 
-def scrape_mouser(component_name, headers): # <--- 已修改
-    vendor_results = []
-    search_url = f"https://www.mouser.tw/Search/Refine?Keyword={component_name}"
+    return vendor_results
 
-    print(f"正在搜尋 Mouser for {component_name}...")
+_CONTENT_TYPE_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
 
+def decode_body(response):
+    """
+    直接以宣告的編碼解碼 response.content，跳過 response.text 對整個頁面做的編碼偵測。
+    依序使用 Content-Type 標頭、頁面開頭的 <meta charset>，都沒有時視為 UTF-8。
+    """
+    content = response.content
+    match = _CONTENT_TYPE_CHARSET.search(response.headers.get('Content-Type', ''))
+    if match is None:
+        match = _META_CHARSET.search(content[:4096])
+    charset = match.group(1) if match else 'utf-8'
+    if isinstance(charset, bytes):
+        charset = charset.decode('ascii', 'ignore')
     try:
-        response = requests.get(search_url, headers=headers, timeout=15)
-        response.raise_for_status()
-
-        if "captcha" in response.text.lower() or "verify" in response.url.lower():
-            print(f"Mouser: 可能遇到反爬蟲機制。")
-            vendor_results.append({
-                "vendor": "Mouser",
-                "error": "可能遇到反爬蟲，請手動訪問或稍後再試。"
-            })
-            return vendor_results
+        return content.decode(charset, errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # --- **重要：這部分需要根據您 F12 觀察到的實際 HTML 結構修改** ---
-        product_rows = soup.find_all('tr', class_='searchResultsRow') 
-
-        if not product_rows:
-            print(f"Mouser: 未找到 '{component_name}' 相關結果，檢查選擇器或結果頁面。")
-            vendor_results.append({
-                "vendor": "Mouser",
-                "error": "未找到產品結果，可能網頁結構有變或無相關產品。"
-            })
-            return vendor_results
+# 保留原本的各廠商函數名稱，方便單獨呼叫
+def scrape_rs_components(component_name, headers):
+    return run_vendor_scraper(VENDOR_REGISTRY["rs"], component_name, headers)
 
-        for row in product_rows[:3]:
-            title_link_tag = row.find('a', class_='MfrPartLink')
-            price_tag = row.find('td', class_='pricing').find('span', class_='pricing-value')
-            stock_tag = row.find('div', class_='availableStock')
-
-            if title_link_tag:
-                title = title_link_tag.get_text(strip=True)
-                link = "https://www.mouser.tw" + title_link_tag['href']
-
-                price = price_tag.get_text(strip=True) if price_tag else "無資訊"
-                stock = stock_tag.get_text(strip=True) if stock_tag else "無資訊"
-
-                vendor_results.append({
-                    "vendor": "Mouser",
-                    "name": title,
-                    "link": link,
-                    "price": price,
-                    "stock": stock
-                })
-            else:
-                print(f"Mouser: 某些產品資訊（標題/連結）未找到。")
+def scrape_wago(component_name, headers):
+    return run_vendor_scraper(VENDOR_REGISTRY["wago"], component_name, headers)
 
-    except requests.exceptions.RequestException as e:
-        print(f"Mouser 訪問錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Mouser",
-            "error": f"訪問失敗: {e}"
-        })
-    except Exception as e:
-        print(f"Mouser 解析錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Mouser",
-            "error": "頁面解析失敗，可能網站結構有變或選擇器錯誤。"
-        })
-    
-    return vendor_results
+def scrape_digikey(component_name, headers):
+    return run_vendor_scraper(VENDOR_REGISTRY["digikey"], component_name, headers)
 
-def scrape_octopart(component_name, headers): # <--- 已修改
-    vendor_results = []
-    search_url = f"https://octopart.com/search?q={component_name}"
+def scrape_mouser(component_name, headers):
+    return run_vendor_scraper(VENDOR_REGISTRY["mouser"], component_name, headers)
 
-    print(f"正在搜尋 Octopart for {component_name}...")
+def scrape_octopart(component_name, headers):
+    return run_vendor_scraper(VENDOR_REGISTRY["octopart"], component_name, headers)
 
+def handle_kss_pdf_info(component_name):
+    """
+    從 KSS 型錄索引查詢料號，回傳結果 list。索引還沒建立（或停用）時回傳請使用者自行查閱 PDF 的說明；
+    索引中沒有這個料號時回傳空 list，不再為每個查詢附上同一段說明。
+    """
+    manual = [VendorResult("KSS", ResultStatus.MANUAL, name="KSS 型錄 (PDF 格式)", link=KSS_CATALOG_LINK)]
+    if not KSS_CATALOG_ENABLED:
+        return manual
     try:
-        response = requests.get(search_url, headers=headers, timeout=20)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # --- **重要：以下選擇器是假設內容在原始 HTML 中可見** ---
-        product_cards = soup.find_all('div', class_='ProductSearch_ProductSummaryCard__vjM4O') 
+        if not len(kss_index):
+            return manual
+        with stage_timer('kss_lookup', 'kss'):
+            entries = kss_index.lookup(component_name)
+        return [_kss_result(entry) for entry in entries]
+    except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+        # 索引檔損毀或格式不符時不能讓整個回覆失敗，改回請使用者自行查閱 PDF
+        log_event('kss_lookup_failed', logging.WARNING, part=component_name, error=repr(e))
+        return manual
+
+def _kss_result(entry):
+    specs = "，".join(f"{name} {value}" for name, value in entry["specs"].items())
+    name = " ".join(part for part in (entry["part"], entry["description"]) if part)
+    return VendorResult(
+        "KSS",
+        name=f"{name}（{specs}）" if specs else name,
+        link=f"{KSS_CATALOG_LINK}#page={entry['page']}",
+    )
 
-        if not product_cards:
-            print(f"Octopart: 未找到 '{component_name}' 相關結果，可能網頁內容動態載入或結構變動。")
-            vendor_results.append({
-                "vendor": "Octopart",
-                "error": "未找到產品結果，可能內容動態載入或結構有變，請考慮使用進階爬蟲或 API。"
-            })
-            return vendor_results
+kss_index = kss_catalog.CatalogIndex(KSS_CATALOG_INDEX)
+_kss_catalog_thread = None
+_kss_catalog_lock = threading.Lock()
+
+def _kss_catalog_loop():
+    # 多個 worker 各有一個這樣的執行緒；以檔案鎖讓同一時間只有一個 worker 下載與重建，
+    # 其他 worker 的 kss_index 會在索引檔被取代後自動重新開啟
+    lock_path = KSS_CATALOG_INDEX + '.lock'
+    while True:
+        lock_file = None
+        try:
+            if fcntl is not None:
+                lock_file = open(lock_path, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            started = time.perf_counter()
+            rebuilt, entries = kss_catalog.ensure_index(KSS_CATALOG_SOURCE, KSS_CATALOG_INDEX)
+            kss_index.reload() # 這個 worker 馬上使用新的索引，其他 worker 在 check_interval 內跟上
+            if rebuilt:
+                log_event('kss_catalog_rebuilt', entries=entries, ms=round((time.perf_counter() - started) * 1000, 1))
+        except BlockingIOError:
+            pass # 其他 worker 正在檢查
+        except Exception as e:
+            log_event('kss_catalog_failed', logging.WARNING, source=KSS_CATALOG_SOURCE, error=repr(e))
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+        time.sleep(KSS_CATALOG_REFRESH_SECONDS)
+
+def _ensure_kss_catalog_refresher():
+    global _kss_catalog_thread
+    if not KSS_CATALOG_ENABLED or _kss_catalog_thread is not None:
+        return
+    with _kss_catalog_lock:
+        if _kss_catalog_thread is None:
+            _kss_catalog_thread = threading.Thread(target=_kss_catalog_loop, name='kss-catalog', daemon=True)
+            _kss_catalog_thread.start()
+
+# --- 熱門料件預先查詢 ---
+class QueryFrequency:
+    """
+    記錄使用者查詢過的料號與查詢頻率（以半衰期遞減），作為預先查詢的優先順序。
+    有價格資料庫時同時寫入資料庫，score / top 以所有 worker 的查詢計算
+    （只有一個 worker 負責預先查詢，只看自己收到的查詢會漏掉其他 worker 的熱門料號）。
+    """
+    def __init__(self, half_life, max_entries=5000, store=None):
+        self.half_life = half_life
+        self.max_entries = max_entries
+        self.store = store
+        self._scores = {} # 正規化料號 -> [分數, 最後更新時間, 使用者輸入的原文]
+        self._lock = threading.Lock()
+
+    def _decayed(self, score, updated_at, now):
+        return score * 0.5 ** ((now - updated_at) / self.half_life)
+
+    def record(self, component_name):
+        key = normalize_component_name(component_name)
+        if not key:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._scores.get(key)
+            score = self._decayed(entry[0], entry[1], now) if entry else 0.0
+            self._scores[key] = [score + 1, now, component_name.strip()]
+            if len(self._scores) > self.max_entries:
+                # 淘汰分數最低的一半
+                ranked = sorted(self._scores.items(), key=lambda item: self._decayed(item[1][0], item[1][1], now))
+                for stale_key, _ in ranked[:len(ranked) // 2]:
+                    del self._scores[stale_key]
+        if self._shared:
+            self.store.record_query(key, component_name.strip(), now, self.half_life)
+
+    @property
+    def _shared(self):
+        return self.store is not None and bool(self.store.path)
+
+    def score(self, component_name):
+        if self._shared:
+            return self.store.query_score(normalize_component_name(component_name), self.half_life)
+        with self._lock:
+            entry = self._scores.get(normalize_component_name(component_name))
+            return self._decayed(entry[0], entry[1], time.time()) if entry else 0.0
+
+    def top(self, n):
+        """回傳分數最高的 n 個 (原文, 分數)。"""
+        if self._shared:
+            return self.store.top_queries(n, self.half_life)
+        now = time.time()
+        with self._lock:
+            ranked = sorted(
+                ((name, self._decayed(score, updated_at, now)) for score, updated_at, name in self._scores.values()),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+        return ranked[:n]
+
+    def __len__(self):
+        return len(self._scores)
+
+query_frequency = QueryFrequency(QUERY_FREQUENCY_HALF_LIFE, store=price_store)
+prefetch_stats = {"cycles": 0, "refreshed": 0, "skipped_fresh": 0, "skipped_unhealthy": 0, "last_cycle_parts": 0}
+_prefetch_thread = None
+_prefetch_lock = threading.Lock()
+_prefetch_lock_file = None
+
+def load_watchlist(path):
+    if not path:
+        return []
+    try:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    except OSError as e:
+        log_event('watchlist_unreadable', logging.WARNING, path=path, error=repr(e))
+        return []
+
+def prefetch_candidates():
+    """清單中的料號加上最近熱門的料號，依最近查詢頻率排序（去除重複）。"""
+    parts = {}
+    for name in load_watchlist(PREFETCH_WATCHLIST_PATH):
+        parts.setdefault(normalize_component_name(name), (name, query_frequency.score(name)))
+    for name, score in query_frequency.top(PREFETCH_TOP_QUERIES):
+        parts.setdefault(normalize_component_name(name), (name, score))
+    return [name for name, _ in sorted(parts.values(), key=lambda item: item[1], reverse=True)]
+
+def prefetch_part(component_name, headers, vendor_delay):
+    """
+    更新單一料號在各廠商的快取。資料還很新（剩餘時間超過一半，包含其他 worker 寫入價格資料庫的結果）
+    或廠商狀態不佳時略過。每個廠商之間間隔 vendor_delay 秒，讓請求平均分散。
+    """
+    for vendor in enabled_vendors():
+        key = (vendor.key, normalize_component_name(component_name))
+        if (lookup_cache.ttl_remaining(key) > vendor.cache_ttl / 2
+                or price_store.last_known(key[1], vendor.key, max_age=vendor.cache_ttl / 2) is not None):
+            prefetch_stats["skipped_fresh"] += 1
+            continue
+        if get_vendor_health(vendor.key).state != 'closed':
+            prefetch_stats["skipped_unhealthy"] += 1
+            continue
+        scrape_and_cache(vendor, key, component_name, headers)
+        prefetch_stats["refreshed"] += 1
+        time.sleep(vendor_delay)
+
+def _acquire_prefetch_lock():
+    """拿到（或已經持有）預先查詢的檔案鎖時回傳 True；鎖在 process 結束時才釋放。"""
+    global _prefetch_lock_file
+    if fcntl is None or not PREFETCH_LOCK_PATH or _prefetch_lock_file is not None:
+        return True
+    lock_file = open(PREFETCH_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _prefetch_lock_file = lock_file
+    return True
+
+def _prefetch_loop():
+    while True:
+        if not _acquire_prefetch_lock():
+            # 其他 worker 正在預先查詢；每個 worker 都查一次會讓同一份資料抓好幾次，也佔用請求額度
+            time.sleep(min(PREFETCH_WINDOW_SECONDS, 60))
+            continue
+        cycle_started = time.monotonic()
+        parts = prefetch_candidates()
+        prefetch_stats["cycles"] += 1
+        prefetch_stats["last_cycle_parts"] = len(parts)
+        vendors = max(1, len(enabled_vendors()))
+        # 每個料號分到的時間；同一廠商兩次請求之間至少間隔 PREFETCH_VENDOR_MIN_INTERVAL
+        slot = max(PREFETCH_WINDOW_SECONDS / max(1, len(parts)), PREFETCH_VENDOR_MIN_INTERVAL)
+        for component_name in parts:
+            slot_started = time.monotonic()
+            try:
+                prefetch_part(component_name, build_request_headers(), slot / vendors)
+            except Exception as e:
+                log_event('prefetch_failed', logging.WARNING, part=component_name, error=repr(e))
+            time.sleep(max(0, slot - (time.monotonic() - slot_started)))
+        time.sleep(max(0, PREFETCH_WINDOW_SECONDS - (time.monotonic() - cycle_started)))
+
+def _ensure_prefetcher():
+    global _prefetch_thread
+    if not PREFETCH_ENABLED or _prefetch_thread is not None:
+        return
+    with _prefetch_lock:
+        if _prefetch_thread is None:
+            _prefetch_thread = threading.Thread(target=_prefetch_loop, name='prefetch', daemon=True)
+            _prefetch_thread.start()
+
+# --- BOM 批次查詢 ---
+_bom_executor = ThreadPoolExecutor(max_workers=BOM_CONCURRENCY, thread_name_prefix='bom')
+_BOM_COMMAND = re.compile(r'^\s*/?bom(?:[\s:：]+|$)', re.IGNORECASE)
+_BOM_PART_COLUMNS = ('part', 'part number', 'part_number', 'mpn', 'pn', '料號', '型號', '品號')
+
+def parse_bom(text):
+    """
+    解析 BOM：可以是 JSON（料號 list、{"part": ...} list 或 {"parts": [...]}）、
+    CSV（有 part/mpn/料號 等欄位名稱時使用該欄，否則使用第一欄），或一行一個料號。
+    格式不正確時丟出 ValueError（/bom 回應 400）。
+    """
+    text = text.strip()
+    if text.startswith('[') or text.startswith('{'):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('parts', [])
+        if not isinstance(data, list):
+            raise ValueError('parts 必須是 list')
+        parts = [_bom_json_part(item.get('part') if isinstance(item, dict) else item) for item in data]
+    else:
+        try:
+            rows = [row for row in csv.reader(io.StringIO(text)) if row and any(cell.strip() for cell in row)]
+        except csv.Error as e:
+            # 例如引號沒有成對，整份檔案被當成一個超過欄位上限的欄位
+            raise ValueError(f'CSV 格式錯誤: {e}') from e
+        column = 0
+        if rows:
+            header = [cell.strip().lower() for cell in rows[0]]
+            for name in _BOM_PART_COLUMNS:
+                if name in header:
+                    column = header.index(name)
+                    rows = rows[1:]
+                    break
+        parts = [row[column] if column < len(row) else '' for row in rows]
+    return [part.strip() for part in parts if part and part.strip()][:BOM_MAX_LINES]
+
+def _bom_json_part(value):
+    # 料號可能被寫成數字（例如 2273202），一律轉成字串；list/dict 等其他型別視為格式錯誤
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'無法辨識的料號: {value!r}')
+    return str(value)
+
+def iter_bom_lookups(parts):
+    """
+    查詢整份 BOM，重複的料號只查一次，依完成順序逐一產生
+    (料號, 在 BOM 中的行號 list, 查詢結果, 耗時秒數)。
+    """
+    lines_by_key = OrderedDict()
+    for index, part in enumerate(parts):
+        lines_by_key.setdefault(normalize_component_name(part), (part, []))[1].append(index)
 
-        for card in product_cards[:3]:
-            title_link_tag = card.find('a', class_='ProductSummaryCard_productLink__aD4sE')
-            
-            # 以下價格/庫存的選擇器需要您仔細觀察 Octopart 頁面來填寫
-            price_tag = card.find('span', class_='ProductSummaryCard_price__some_hash') 
-            stock_tag = card.find('span', class_='ProductSummaryCard_stock__some_hash') 
-            
-            if title_link_tag:
-                title = title_link_tag.get_text(strip=True)
-                link = "https://octopart.com" + title_link_tag['href']
-
-                price = price_tag.get_text(strip=True) if price_tag else "無資訊"
-                stock = stock_tag.get_text(strip=True) if stock_tag else "無資訊"
-
-                vendor_results.append({
-                    "vendor": "Octopart",
-                    "name": title,
-                    "link": link,
-                    "price": price,
-                    "stock": stock
-                })
-            else:
-                print(f"Octopart: 某些產品資訊未找到。")
+    def lookup(part):
+        started = time.monotonic()
+        return search_component_info(part), time.monotonic() - started
 
-    except requests.exceptions.RequestException as e:
-        print(f"Octopart 訪問錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Octopart",
-            "error": f"訪問失敗: {e}"
-        })
-    except Exception as e:
-        print(f"Octopart 解析錯誤: {e}")
-        vendor_results.append({
-            "vendor": "Octopart",
-            "error": "頁面解析失敗，可能網站結構有變或選擇器錯誤，或內容為JS動態載入。"
-        })
-    
-    return vendor_results
-
-def handle_kss_pdf_info():
-    return {
-        "vendor": "KSS",
-        "name": "KSS 型錄 (PDF 格式)",
-        "link": "https://www.kss.com.tw/filedown.php?file=catalog.pdf&site=dXBsb2FkL3RlY3Bkb3duLzQ4Ny1DUy5wZGY=",
-        "price": "請自行查閱 PDF",
-        "stock": "請自行查閱 PDF",
-        "error": "需手動查閱 PDF 型錄，自動化查詢困難。"
+    futures = {
+        _bom_executor.submit(lookup, part): (part, lines)
+        for part, lines in lines_by_key.values()
     }
+    try:
+        for future in as_completed(futures):
+            part, lines = futures[future]
+            try:
+                results, elapsed = future.result()
+            except Exception as e:
+                log_event('bom_lookup_failed', logging.ERROR, part=part, error=repr(e))
+                results, elapsed = [VendorResult("", ResultStatus.FAILED)], 0.0
+            yield part, lines, results, elapsed
+    finally:
+        # 呼叫端提前結束（例如 /bom 的連線中斷）時，取消還沒開始的查詢，不再向廠商發送請求
+        for future in futures:
+            future.cancel()
+
+def format_bom_line(part, results):
+    """一個料號一行的摘要：各廠商第一筆結果的價格/庫存。"""
+    summaries = []
+    seen = set()
+    for item in results:
+        if item.vendor in seen or not item.ok:
+            continue
+        seen.add(item.vendor)
+        summaries.append(f"{item.vendor} {item.text('price')}/{item.text('stock')}")
+    return f"{part}：" + ("；".join(summaries) if summaries else "查無販售資訊")
+
+@app.route("/bom", methods=['POST'])
+def bom():
+    """
+    批次查詢 BOM，結果以 NDJSON 逐行串流回傳（每完成一個料號一行，最後一行為統計）。
+    """
+    if not BOM_API_TOKEN:
+        abort(404)
+    auth = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth, f"Bearer {BOM_API_TOKEN}"):
+        abort(401)
+    try:
+        parts = parse_bom(request.get_data(as_text=True))
+    except ValueError:
+        abort(400)
+
+    def generate():
+        started = time.monotonic()
+        unique = 0
+        for part, lines, results, elapsed in iter_bom_lookups(parts):
+            unique += 1
+            yield json.dumps({
+                "part": part,
+                "lines": [index + 1 for index in lines],
+                "results": [item.to_dict() for item in results],
+                "elapsed": round(elapsed, 3),
+            }, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "done": True,
+            "parts": len(parts),
+            "unique": unique,
+            "elapsed": round(time.monotonic() - started, 3),
+        }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def handle_bom_command(event, text):
+    """
+    LINE 指令：「BOM」後面接料號（換行或逗號分隔）。先回覆收到，
+    之後每完成 BOM_PUSH_BATCH 個料號就推送一次摘要。
+    """
+    parts = [part.strip() for part in re.split(r'[\n,，;；]+', text) if part.strip()][:BOM_MAX_LINES]
+    if not parts:
+        send_reply(event, [TextSendMessage(text="請在 BOM 後面輸入料號，每行一個，例如：\nBOM\n2273-202\n221-412")])
+        return
+    send_reply(event, [TextSendMessage(text=f"開始查詢 {len(parts)} 個料號，完成的結果會陸續傳送。")])
+
+    total = len({normalize_component_name(part) for part in parts})
+    pending = []
+    done = 0
+    for part, _, results, _ in iter_bom_lookups(parts):
+        pending.append(format_bom_line(part, results))
+        done += 1
+        if len(pending) >= BOM_PUSH_BATCH:
+            push_messages(event, _join_lines(pending, header=f"BOM 查詢進度 {done}/{total}"))
+            pending = []
+    if pending:
+        push_messages(event, _join_lines(pending, header="BOM 查詢完成"))
+
+def _join_lines(lines, header):
+    """把多行文字合併成不超過 1800 字元的 TextSendMessage。"""
+    messages = []
+    current = header + "\n"
+    for line in lines:
+        if len(current) + len(line) + 1 > 1800:
+            messages.append(TextSendMessage(text=current.strip()))
+            current = ""
+        current += line + "\n"
+    if current.strip():
+        messages.append(TextSendMessage(text=current.strip()))
+    return messages
 
 # --- 更新訊息處理器 ---
-@handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     user_message = event.message.text
-    reply_token = event.reply_token
-
-    print(f"使用者傳送了: {user_message}") # 在您的電腦控制台印出使用者訊息
 
+    log_event('message', sampled=True, text=(user_message or '')[:100]) # 抽樣記錄使用者訊息
+
+    bom_command = _BOM_COMMAND.match(user_message or '')
+    if bom_command:
+        handle_bom_command(event, user_message[bom_command.end():])
+        return
+
+    suggestions = []
+    if user_message:
+        user_message, suggestions = resolve_query(event, user_message)
+        if user_message is None: # 已知查無結果，已回覆「您是不是要找」的建議
+            return
+    if user_message and PROGRESSIVE_REPLY_ENABLED:
+        query_frequency.record(user_message) # 作為預先查詢的優先順序
+        reply_progressively(event, user_message, suggestions)
+        return
     if user_message: # 只有當使用者發送了訊息才進行查詢
+        query_frequency.record(user_message) # 作為預先查詢的優先順序
         # 呼叫我們的料件查詢函數
         search_results = search_component_info(user_message)
         reply_messages = format_search_results_for_line(search_results)
+        if suggestions:
+            reply_messages.append(suggestion_message(suggestions))
     else:
         # 如果使用者發送了空訊息或其他非文字訊息，給出提示
         reply_messages = [TextSendMessage(text="您好！請輸入您想查詢的料件名稱或型號。")]
 
-    # 使用 LINE Bot API 發送回覆訊息
-    line_bot_api.reply_message(
-        reply_token,
-        reply_messages # 現在可以發送多個訊息或不同的訊息類型
-    )
+    # 使用 LINE Bot API 發送回覆訊息（reply token 過期時改用 push）
+    send_reply(event, reply_messages) # 現在可以發送多個訊息或不同的訊息類型
+
+def resolve_query(event, user_message):
+    """
+    查詢前先用料號索引把各種寫法對應到已知的料號，回傳 (要查詢的料號, 相似料號清單)。
+    不認得的料號照常查詢（同系列的料號常常只差一碼，不能當成打錯字），相似料號在第一則回覆
+    以快速回覆按鈕選擇。只有各廠商最近的結果都是「找不到」時，才直接回覆建議並回傳 (None, 建議)，
+    不查詢任何廠商。開頭加上「!」可以略過索引，照原樣查詢。
+    """
+    text = user_message.strip()
+    if text[:1] in ('!', '！'):
+        part_index.count_lookup("bypassed")
+        return text[1:].strip(), []
+    if not PART_INDEX_ENABLED:
+        return text, []
+    canonical, suggestions = part_index.resolve(text)
+    if canonical is not None:
+        return canonical, []
+    if not suggestions or not known_not_found(text):
+        return text, suggestions
+
+    buttons = [QuickReplyButton(action=MessageAction(label=part[:20], text=part)) for part in suggestions]
+    buttons.append(QuickReplyButton(action=MessageAction(label=f"查詢 {text}"[:20], text=f"!{text}"[:300])))
+    lines = "\n".join(f"・{part}" for part in suggestions)
+    send_reply(event, [TextSendMessage(
+        text=f"最近查詢「{text}」各廠商都沒有結果，您是不是要找：\n{lines}\n\n確定要重新查詢原本的料號，請在前面加上 !，例如 !{text}",
+        quick_reply=QuickReply(items=buttons),
+    )])
+    log_event('part_suggested', sampled=True, part=text, suggestions=suggestions)
+    return None, suggestions
+
+def known_not_found(component_name):
+    """
+    各廠商最近的結果（process 內的快取，或價格資料庫中還在 cache_ttl 內的紀錄，
+    包含其他 worker 寫入的「找不到」空白紀錄）都是「找不到」時回傳 True。
+    只要有一家沒有資料或有結果就回傳 False。
+    """
+    part_key = normalize_component_name(component_name)
+    vendors = enabled_vendors()
+    for vendor in vendors:
+        vendor_results = lookup_cache.peek((vendor.key, part_key))
+        if vendor_results is None:
+            last_known = price_store.last_known(part_key, vendor.key, max_age=vendor.cache_ttl)
+            vendor_results = last_known[0] if last_known else None
+        if vendor_results is None or any(item.status != ResultStatus.NOT_FOUND for item in vendor_results):
+            return False
+    return bool(vendors)
+
+def suggestion_message(suggestions, intro="您是不是也要找："):
+    """相似料號，以快速回覆按鈕選擇。"""
+    buttons = [QuickReplyButton(action=MessageAction(label=part[:20], text=part)) for part in suggestions]
+    lines = "\n".join(f"・{part}" for part in suggestions)
+    return TextSendMessage(text=f"{intro}\n{lines}", quick_reply=QuickReply(items=buttons))
+
+def reply_progressively(event, component_name, suggestions=()):
+    """
+    各廠商的結果一完成就格式化送出：第一批用 reply_message，之後用 push_message。
+    KSS 的型錄索引在本機，有符合的料號時最先送出。
+    有資料的結果馬上送出；錯誤（逾時、反爬蟲、找不到等）與 KSS 說明累積到最後一批一起送，
+    避免為了沒有內容的訊息多用推播次數。
+    有 suggestions（相似料號）時不等廠商結果，先以第一則回覆送出建議，之後的結果都用推播。
+    """
+    started = time.perf_counter()
+    sent = 0
+    replied = False
+    pending_errors = []
+    if suggestions:
+        send_reply(event, [suggestion_message(
+            suggestions, intro=f"「{component_name}」不是已知的料號，正在查詢各廠商，結果稍後送出。\n您是不是要找：")])
+        replied = True
+    # KSS 從本機索引查詢，不需要等待，和第一個完成的廠商一起排在最前面
+    kss_results = [(None, handle_kss_pdf_info(component_name))]
+    for vendor, vendor_results in itertools.chain(kss_results, iter_vendor_results(component_name)):
+        found = [item for item in vendor_results if item.ok]
+        pending_errors.extend(item for item in vendor_results if not item.ok)
+        if not found:
+            continue
+        messages = format_search_results_for_line(found, header=None if sent else "找到以下料件資訊：")
+        _send_batch(event, messages, first=not replied)
+        if not sent:
+            first_answer_seconds.observe(time.time() - event.timestamp / 1000)
+        sent += 1
+        replied = True
+
+    # 都已經送出結果、也沒有錯誤要補充時，不再送最後一批（否則會多一則「沒有找到」）
+    if not sent or pending_errors:
+        messages = format_search_results_for_line(pending_errors, header="其他廠商：" if sent else "找到以下料件資訊：")
+        _send_batch(event, messages, first=not replied)
+        sent += 1
+    search_seconds.observe(time.perf_counter() - started)
+    log_event('progressive_reply', sampled=True, part=component_name, batches=sent,
+              ms=round((time.perf_counter() - started) * 1000, 1))
+
+def _send_batch(event, messages, first):
+    if first:
+        send_reply(event, messages)
+    else:
+        push_messages(event, messages)
 
 # --- 新增格式化搜尋結果的函數 (準備 LINE 訊息) ---
-def format_search_results_for_line(all_results):
+def format_search_results_for_line(all_results, header="找到以下料件資訊："):
     """
     將所有搜尋結果格式化成 LINE 訊息。
     考慮使用多個 TextMessage 或 FlexMessage。
+    header 為 None 時不加開頭文字，分批回覆的後續批次使用。
     """
+    with stage_timer('format'):
+        return _format_search_results(all_results, header)
+
+def _freshness_text(fetched_at):
+    # 超過一分鐘的資料標示查詢時間，讓使用者知道不是即時資料
+    if not fetched_at:
+        return ""
+    age_minutes = int((time.time() - fetched_at) // 60)
+    if age_minutes < 1:
+        return ""
+    if age_minutes < 60:
+        return f"資料時間: {age_minutes} 分鐘前\n"
+    return f"資料時間: {age_minutes // 60} 小時前\n"
+
+def _format_search_results(all_results, header):
     messages = []
     if not all_results:
-        messages.append(TextSendMessage(text="抱歉，沒有找到相關料件的販售資訊。請嘗試其他關鍵字。"))
+        if header is not None:
+            messages.append(TextSendMessage(text="抱歉，沒有找到相關料件的販售資訊。請嘗試其他關鍵字。"))
         return messages
     
     # 為了簡潔，我們現在先使用多個 TextMessage
     # 如果要更好的體驗，應該用 Flex Message (更複雜)
     
-    current_message_text = "找到以下料件資訊：\n\n"
+    current_message_text = f"{header}\n\n" if header is not None else ""
     for item in all_results:
-        if isinstance(item, dict):
+        if isinstance(item, VendorResult):
             # 處理錯誤訊息
-            if "error" in item:
-                item_text = f"廠商: {item['vendor']}\n狀態: {item['error']}\n\n"
+            if not item.ok:
+                item_text = f"廠商: {item.vendor}\n狀態: {item.error}\n\n"
             else:
-                # 正常結果
+                # 正常結果（沒有值的欄位在這裡才補上預設文字）
                 item_text = (
-                    f"廠商: {item.get('vendor', '未知廠商')}\n"
-                    f"名稱: {item.get('name', 'N/A')}\n"
-                    f"價格/庫存: {item.get('price', 'N/A')} / {item.get('stock', 'N/A')}\n"
-                    f"連結: {item.get('link', 'N/A')}\n\n"
+                    f"廠商: {item.vendor or '未知廠商'}\n"
+                    f"名稱: {item.text('name')}\n"
+                    f"價格/庫存: {item.text('price')} / {item.text('stock')}\n"
+                    f"{_freshness_text(item.fetched_at)}"
+                    f"連結: {item.text('link')}\n\n"
                 )
             
             # 檢查訊息長度，避免超出 LINE 的單條訊息限制 (2000 字元)
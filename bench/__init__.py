@@ -0,0 +1,17 @@
+"""
+離線效能測試工具，請在專案根目錄以 python -m bench.<名稱> 執行。
+"""
+import os
+
+# app.py 匯入時會檢查 LINE 的環境變數，離線測試時給假的值即可
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'bench')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'bench')
+# 預設不使用跨 process 共用的結果檔與價格資料庫，避免量測結果被先前的資料影響
+os.environ.setdefault('SINGLE_FLIGHT_DIR', '')
+os.environ.setdefault('PRICE_DB_PATH', '')
+# 重播 captcha/timeout 等情境時每個請求都會記錄警告，量測時只輸出錯誤
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+# 請求頻率限制只在 process 內計算，不受其他正在執行的 worker 影響
+os.environ.setdefault('RATE_LIMIT_DIR', '')
+# 不下載 KSS 型錄（不連到真實網站），KSS 維持請使用者自行查閱 PDF 的說明
+os.environ.setdefault('KSS_CATALOG_ENABLED', '0')
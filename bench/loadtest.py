@@ -0,0 +1,239 @@
+"""
+以真的 gunicorn 比較不同服務設定的吞吐量與記憶體。廠商頁面由本機的假網站提供，不會連到真實網站。
+
+    python -m bench.loadtest [--preset sync] [--preset gthread] [--preset gthread-aiohttp] [--preset gevent]
+        [--concurrency 50] [--requests 300] [--latency 1.0] [--filler-kb 20] [--workers 2] [--threads 16]
+
+每個請求以 /bom 查詢一個不重複的料號（關閉快取與請求頻率限制），
+所有廠商同時查詢，回應時間約為最慢的廠商（--latency）加上排隊時間。
+假網站以 127.0.0.x 區分各廠商的 host（Linux 上整個 127.0.0.0/8 都連到本機）。
+
+輸出每秒請求數、延遲 p50/p95、所有 worker 閒置與尖峰時的 RSS，
+以及尖峰時多出來的 RSS 平均到每個同時進行中的請求。
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from aiohttp import web
+
+import bench # noqa: F401  設定假的 LINE 環境變數
+import app
+from bench.pages import synthetic_page
+from bench.replay import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = 'loadtest'
+
+# 各設定對應的環境變數；sync 為改版前的設定（每個 worker 同時只處理一個請求）
+PRESETS = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_TIMEOUT': '300'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread'},
+    'gthread-aiohttp': {'GUNICORN_WORKER_CLASS': 'gthread', 'FETCH_BACKEND': 'aiohttp'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent'},
+}
+
+class FakeVendorSite:
+    """在背景執行緒以 aiohttp 提供各廠商的假搜尋頁，每個請求延遲 latency 秒（±20%）。"""
+    def __init__(self, vendors, latency, filler_kb):
+        self.pages = {vendor.key: synthetic_page(vendor, rows=5, filler_kb=filler_kb) for vendor in vendors}
+        self.latency = latency
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+
+    async def _handle(self, request):
+        await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+        return web.Response(body=self.pages[request.match_info['key']], content_type='text/html', charset='utf-8')
+
+    async def _start(self, addresses):
+        site_app = web.Application()
+        site_app.router.add_get('/{key}', self._handle)
+        runner = web.AppRunner(site_app, access_log=None)
+        await runner.setup()
+        for address in addresses:
+            site = web.TCPSite(runner, address, self.port or 0, backlog=1024)
+            await site.start()
+            if self.port is None:
+                self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self, addresses):
+        threading.Thread(target=self._loop.run_forever, name='fake-vendors', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(addresses), self._loop).result()
+
+def write_vendor_config(vendors, port):
+    """讓每個廠商的搜尋網址指向假網站（各自一個 127.0.0.x host）。"""
+    config = [
+        {"key": vendor.key, "url_template": f"http://127.0.0.{index + 2}:{port}/{vendor.key}?q={{query}}"}
+        for index, vendor in enumerate(vendors)
+    ]
+    fd, path = tempfile.mkstemp(prefix='loadtest-vendors-', suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    return path
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def worker_pids(master_pid):
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # 第 4 個欄位是 parent pid（程式名稱可能含空白，從最後一個括號之後開始算）
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                    pids.append(int(name))
+        except (OSError, ValueError, IndexError):
+            continue
+    return pids
+
+def rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+class RssSampler(threading.Thread):
+    def __init__(self, master_pid):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.peak = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(0.1):
+            self.peak = max(self.peak, rss_mb(worker_pids(self.master_pid)))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def start_server(preset, args, vendor_config):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'BOM_API_TOKEN': TOKEN,
+        'VENDOR_CONFIG_PATH': vendor_config,
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        # 只量測服務本身：不快取、不限制請求頻率，查詢用的執行緒也不設限
+        'LOOKUP_CACHE_SIZE': '0',
+        'HOST_RATE': '0',
+        'HOST_MAX_CONCURRENCY': str(args.concurrency),
+        'HTTP_POOL_SIZE': str(args.concurrency),
+        'LOOKUP_CONCURRENCY': str(args.concurrency),
+        'BOM_CONCURRENCY': str(args.concurrency),
+        'PART_INDEX_ENABLED': '0',
+    })
+    env.update(PRESETS[preset])
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/stats', timeout=1).ok:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{preset}: gunicorn 沒有啟動')
+
+def lookup(base_url, part):
+    response = requests.post(
+        base_url + '/bom', data=part, timeout=300,
+        headers={'Authorization': f'Bearer {TOKEN}', 'Content-Type': 'text/plain'},
+    )
+    return response.ok and response.text.rstrip().endswith('}')
+
+def run_preset(preset, args, vendor_config):
+    process, base_url = start_server(preset, args, vendor_config)
+    try:
+        # 每個 worker 先處理幾個請求，建立連線池與執行緒，之後的 RSS 才是閒置時的基準
+        with ThreadPoolExecutor(max_workers=args.workers * 2) as executor:
+            list(executor.map(lambda i: lookup(base_url, f'WARMUP-{preset}-{i}'), range(args.workers * 4)))
+        idle_rss = rss_mb(worker_pids(process.pid))
+
+        sampler = RssSampler(process.pid)
+        sampler.start()
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def timed(i):
+            nonlocal errors
+            started = time.perf_counter()
+            ok = lookup(base_url, f'LT-{preset}-{i:06d}')
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                errors += 0 if ok else 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(timed, range(args.requests)))
+        total = time.perf_counter() - started
+        sampler.stop()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    ordered = sorted(latencies)
+    growth = max(0.0, sampler.peak - idle_rss)
+    print(f'{preset:<16} {len(ordered) / total:8.1f} {percentile(ordered, 50):7.2f}s {percentile(ordered, 95):7.2f}s '
+          f'{errors:6d} {idle_rss:9.1f}MB {sampler.peak:9.1f}MB {growth / args.concurrency * 1024:12.0f}KB')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', action='append', choices=sorted(PRESETS), help='可重複指定，預設全部')
+    parser.add_argument('--concurrency', type=int, default=50, help='同時進行的請求數')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=1.0, help='假網站每個請求的延遲（秒）')
+    parser.add_argument('--filler-kb', type=int, default=20, help='假頁面的大小（KB），越大解析越吃 CPU')
+    parser.add_argument('--workers', type=int, default=2, help='WEB_CONCURRENCY')
+    parser.add_argument('--threads', type=int, default=16, help='GUNICORN_THREADS（gthread）')
+    args = parser.parse_args()
+
+    presets = args.preset or [name for name in PRESETS if name != 'gevent' or _has_gevent()]
+    vendors = app.enabled_vendors()
+    site = FakeVendorSite(vendors, args.latency, args.filler_kb)
+    site.start([f'127.0.0.{index + 2}' for index in range(len(vendors))])
+    vendor_config = write_vendor_config(vendors, site.port)
+
+    print(f'vendors={len(vendors)} concurrency={args.concurrency} requests={args.requests} '
+          f'latency={args.latency}s page={args.filler_kb}KB workers={args.workers} threads={args.threads}')
+    print(f'{"preset":<16} {"req/s":>8} {"p50":>8} {"p95":>8} {"errors":>6} {"idle RSS":>11} {"peak RSS":>11} {"RSS/concurrent":>14}')
+    try:
+        for preset in presets:
+            run_preset(preset, args, vendor_config)
+    finally:
+        os.remove(vendor_config)
+
+def _has_gevent():
+    return importlib.util.find_spec('gevent') is not None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+量測同時進行多個查詢時，每個查詢佔用多少記憶體（RSS）。廠商頁面由本機的假網站提供，不會連到真實網站。
+
+    python -m bench.memory_bench [--concurrency 1 10 50] [--latency 1.0] [--filler-kb 200]
+        [--backend requests] [--max-body-kb 2048] [--result-copies 10000]
+
+每個同時數在新的 process 中執行（RSS 釋放後通常不會還給系統，同一個 process 連續量測會互相影響）：
+先查詢幾個料號讓連線池、執行緒建立起來，記下閒置時的 RSS，再同時查詢 N 個不重複的料號，
+以背景執行緒取樣 RSS 的尖峰。輸出尖峰多出來的 RSS 平均到每個查詢。
+--filler-kb 越大，下載內容、解碼後的文字與解析樹佔用的記憶體越明顯；
+--max-body-kb 對應 MAX_RESPONSE_BYTES。
+
+最後比較查詢結果以 VendorResult 與以 dict（to_dict()）保存時，--result-copies 份結果佔用的記憶體。
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import bench # noqa: F401  設定假的 LINE 環境變數
+import app
+from bench.loadtest import FakeVendorSite, write_vendor_config
+from bench.replay import percentile
+
+def vm_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+class PeakSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = vm_rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(0.02):
+            self.peak = max(self.peak, vm_rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def run_child(args):
+    """在子 process 中執行：同時查詢 args.concurrency 個料號，輸出一行 JSON。"""
+    for i in range(2):
+        app.search_component_info(f'WARMUP-{i}')
+    gc.collect()
+    idle = vm_rss_mb()
+
+    latencies = []
+    def lookup(i):
+        started = time.perf_counter()
+        results = app.search_component_info(f'MEM-{args.concurrency}-{i:05d}')
+        latencies.append(time.perf_counter() - started)
+        return sum(1 for item in results if item.ok)
+
+    sampler = PeakSampler()
+    sampler.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        found = sum(executor.map(lookup, range(args.concurrency)))
+    sampler.stop()
+    print(json.dumps({
+        "idle": idle,
+        "peak": sampler.peak,
+        "found": found,
+        "p50": percentile(sorted(latencies), 50),
+    }))
+
+def spawn(concurrency, args, vendor_config, vendors):
+    env = dict(os.environ)
+    env.update({
+        'VENDOR_CONFIG_PATH': vendor_config,
+        'FETCH_BACKEND': args.backend,
+        'MAX_RESPONSE_BYTES': str(args.max_body_kb * 1024),
+        # 只量測查詢本身：不快取、不限制請求頻率，所有查詢同時進行
+        'LOOKUP_CACHE_SIZE': '0',
+        'HOST_RATE': '0',
+        'PART_INDEX_ENABLED': '0',
+        'HOST_MAX_CONCURRENCY': str(concurrency),
+        'HTTP_POOL_SIZE': str(concurrency),
+        'SEARCH_MAX_WORKERS': str(concurrency * vendors),
+    })
+    output = subprocess.run(
+        [sys.executable, '-m', 'bench.memory_bench', '--child', '--concurrency', str(concurrency)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def result_model_mb(copies):
+    """copies 份查詢結果（5 家廠商各 3 筆）分別以 VendorResult 與 dict 保存時佔用的記憶體（MB）。"""
+    sample = [
+        app.VendorResult(vendor.name, name=f'{vendor.name} 料件 2273-20{row} 端子台',
+                         link=f'https://example.com/{vendor.key}/{row}', price='NT$12.50', stock='1,234',
+                         fetched_at=time.time())
+        for vendor in app.enabled_vendors() for row in range(3)
+    ]
+    sizes = []
+    for build in (lambda item: app.VendorResult(**{field: getattr(item, field) for field in app.VendorResult.__slots__}),
+                  lambda item: item.to_dict()):
+        gc.collect()
+        tracemalloc.start()
+        kept = [[build(item) for item in sample] for _ in range(copies)]
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        sizes.append(current / 1024 / 1024)
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50], help='同時進行的查詢數，可指定多個')
+    parser.add_argument('--latency', type=float, default=1.0, help='假網站每個請求的延遲（秒）')
+    parser.add_argument('--filler-kb', type=int, default=200, help='假頁面的大小（KB）')
+    parser.add_argument('--backend', choices=['requests', 'aiohttp'], default='requests', help='FETCH_BACKEND')
+    parser.add_argument('--max-body-kb', type=int, default=2048, help='MAX_RESPONSE_BYTES（KB），0 為不限制')
+    parser.add_argument('--result-copies', type=int, default=10000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.concurrency = args.concurrency[0]
+        run_child(args)
+        return
+
+    vendors = app.enabled_vendors()
+    site = FakeVendorSite(vendors, args.latency, args.filler_kb)
+    site.start([f'127.0.0.{index + 2}' for index in range(len(vendors))])
+    vendor_config = write_vendor_config(vendors, site.port)
+
+    print(f'vendors={len(vendors)} latency={args.latency}s page={args.filler_kb}KB '
+          f'backend={args.backend} max_body={args.max_body_kb}KB parser={app.HTML_PARSER}')
+    print(f'{"concurrent":>10} {"p50":>8} {"found":>6} {"idle RSS":>11} {"peak RSS":>11} {"RSS/lookup":>11}')
+    try:
+        for concurrency in args.concurrency:
+            row = spawn(concurrency, args, vendor_config, len(vendors))
+            growth = max(0.0, row["peak"] - row["idle"])
+            print(f'{concurrency:>10} {row["p50"]:7.2f}s {row["found"]:>6} {row["idle"]:9.1f}MB '
+                  f'{row["peak"]:9.1f}MB {growth / concurrency * 1024:9.0f}KB')
+    finally:
+        os.remove(vendor_config)
+
+    compact, dicts = result_model_mb(args.result_copies)
+    lookups = args.result_copies
+    print(f'{lookups} 份查詢結果（{len(vendors)} 家 x 3 筆）：VendorResult {compact:.1f}MB，dict {dicts:.1f}MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+測試用的廠商頁面：優先讀取存下來的真實頁面（<目錄>/<廠商 key>.html），
+沒有的話依照廠商的 Selector 產生一個結構相近、大小相近的假頁面。
+"""
+import os
+import random
+
+# 一般搜尋結果頁大約有幾百 KB 的導覽列、script 與樣式
+FILLER_KB = 300
+TOTAL_ROWS = 25
+
+def _element(selector_part, inner, href=None):
+    tag, _, classes = selector_part.partition('.')
+    attrs = f' class="{classes.replace(".", " ")}"' if classes else ''
+    if href:
+        attrs += f' href="{href}"'
+    return f'<{tag}{attrs}>{inner}</{tag}>'
+
+def _nested(selector, inner, href=None):
+    parts = selector.split()
+    html = _element(parts[-1], inner, href)
+    for part in reversed(parts[:-1]):
+        html = _element(part, html)
+    return html
+
+def _row(vendor, index):
+    cells = []
+    seen = {}
+    for field_name, field_spec in vendor.fields.items():
+        if not field_spec.selector:
+            continue
+        seen.setdefault(field_spec.selector, {})[field_spec.attr or 'text'] = field_name
+    for selector, parts in seen.items():
+        text = f'{vendor.name} 料件 2273-{200 + index} 端子台' if 'name' in parts.values() else f'NT${index * 3 + 12}.50'
+        href = f'/product/{index}' if 'href' in parts else None
+        cells.append(_nested(selector, text, href))
+    return _nested(vendor.row_selector, ''.join(cells))
+
+def _filler(kb, seed):
+    rng = random.Random(seed)
+    chunks = []
+    size = 0
+    while size < kb * 1024:
+        n = rng.randint(0, 10000)
+        chunk = (
+            f'<div class="nav-item nav-{n}"><a href="/category/{n}">分類 {n} 連接器 Connectors</a>'
+            f'<span class="hint">相關產品 {n}</span></div>\n'
+            f'<script>window.__data_{n} = {{"id": {n}, "label": "item-{n}"}};</script>\n'
+        )
+        chunks.append(chunk)
+        size += len(chunk.encode('utf-8'))
+    return ''.join(chunks)
+
+def synthetic_page(vendor, rows=TOTAL_ROWS, filler_kb=FILLER_KB):
+    """產生一個假的搜尋結果頁（bytes, UTF-8）。"""
+    row_tag = vendor.row_selector.split()[0].split('.')[0]
+    body_rows = ''.join(_row(vendor, i) for i in range(rows))
+    if row_tag == 'tr':
+        body_rows = f'<table class="results"><tbody>{body_rows}</tbody></table>'
+    html = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>搜尋結果</title></head><body>'
+        + _filler(filler_kb * 2 // 3, vendor.key)
+        + f'<div id="results">{body_rows}</div>'
+        + _filler(filler_kb // 3, vendor.key + '-footer')
+        + '</body></html>'
+    )
+    return html.encode('utf-8')
+
+def load_page(vendor, pages_dir=None):
+    """回傳 (頁面 bytes, 來源說明)。"""
+    if pages_dir:
+        path = os.path.join(pages_dir, f'{vendor.key}.html')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return f.read(), path
+    return synthetic_page(vendor), 'synthetic'
@@ -0,0 +1,74 @@
+"""
+比較 HTML 解析路徑的速度：
+
+- baseline：原本的 response.text（含編碼偵測）+ 完整的 html.parser 樹
+- fallback：decode_body + html.parser + 截斷/SoupStrainer（沒有安裝 lxml 時的路徑）
+- fast：decode_body + lxml + 截斷/SoupStrainer（目前的預設路徑）
+
+用法：python -m bench.parse_bench [--pages 存檔目錄] [--repeat 20]
+"""
+import argparse
+import statistics
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+import bench # noqa: F401  設定假的 LINE 環境變數
+import app
+from bench.pages import load_page
+
+def _response(content, content_type):
+    response = requests.Response()
+    response._content = content
+    response.status_code = 200
+    if content_type:
+        response.headers['Content-Type'] = content_type
+    return response
+
+def baseline(vendor, content, content_type):
+    response = _response(content, content_type)
+    soup = BeautifulSoup(response.text, 'html.parser')
+    return soup.select(vendor.row_selector)[:vendor.max_rows]
+
+def optimized(parser):
+    def run(vendor, content, content_type):
+        previous, app.HTML_PARSER = app.HTML_PARSER, parser
+        try:
+            return vendor.parse_rows(app.decode_body(_response(content, content_type)))
+        finally:
+            app.HTML_PARSER = previous
+    return run
+
+def measure(func, vendor, content, content_type, repeat):
+    samples = []
+    rows = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = func(vendor, content, content_type)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', help='存放 <廠商 key>.html 的目錄，沒有的廠商使用假頁面')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--content-type', default='text/html',
+                        help='模擬的 Content-Type 標頭；設為空字串時 requests 會對整頁做編碼偵測')
+    args = parser.parse_args()
+
+    paths = [('baseline', baseline), ('fallback', optimized('html.parser'))]
+    if app._DEFAULT_HTML_PARSER == 'lxml':
+        paths.append(('fast', optimized('lxml')))
+
+    print(f"{'vendor':<14}{'size':>9}  " + ''.join(f'{name:>14}' for name, _ in paths) + '  source')
+    for vendor in app.VENDOR_REGISTRY.values():
+        content, source = load_page(vendor, args.pages)
+        cells = []
+        for _, func in paths:
+            ms, rows = measure(func, vendor, content, args.content_type, args.repeat)
+            cells.append(f'{ms:9.2f}ms/{rows}r')
+        print(f'{vendor.key:<14}{len(content) // 1024:>7}KB  ' + ''.join(f'{cell:>14}' for cell in cells) + f'  {source}')
+
+if __name__ == '__main__':
+    main()
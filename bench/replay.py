@@ -0,0 +1,274 @@
+"""
+以錄好的廠商頁面重播，離線量測整個查詢流程，不會連到真實網站。
+
+錄製頁面（會連到真實網站，每個廠商一次）：
+    python -m bench.replay record 2273-202
+
+重播並量測：
+    python -m bench.replay run [--parts 料號清單檔] [--iterations 50] [--concurrency 4]
+        [--latency 0.3] [--profile digikey=slow:3] [--profile octopart=timeout]
+        [--profile mouser=captcha] [--profile rs=error] [--target search scrapers format]
+        [--cache] [--tracemalloc]
+
+--profile 的種類：
+    ok[:秒]       正常回應（可指定延遲）
+    slow:秒       回應很慢
+    timeout       一直等到 timeout 然後丟出 ReadTimeout
+    captcha       回傳反爬蟲驗證頁
+    error         回傳 503
+
+沒有錄製檔的廠商會使用 bench.pages 產生的假頁面。
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import bench # noqa: F401  設定假的 LINE 環境變數
+import app
+from bench.pages import load_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+DEFAULT_PARTS = [
+    '2273-202', '221-412', '2002-1201', '750-1500', 'STM32F103C8T6',
+    'ATMEGA328P-PU', 'NE555P', 'LM358N', 'ESP32-WROOM-32E', 'LM2596S-5.0',
+]
+
+CAPTCHA_PAGE = (
+    b'<html><head><title>Verify</title></head><body>'
+    b'<div class="g-recaptcha">Please complete the captcha to continue</div></body></html>'
+)
+
+class Profile:
+    def __init__(self, kind='ok', latency=None):
+        self.kind = kind
+        self.latency = latency
+
+    @classmethod
+    def parse(cls, text):
+        kind, _, latency = text.partition(':')
+        if kind not in ('ok', 'slow', 'timeout', 'captcha', 'error'):
+            raise argparse.ArgumentTypeError(f'未知的 profile 種類: {kind}')
+        return cls(kind, float(latency) if latency else None)
+
+class ReplayAdapter(BaseAdapter):
+    """
+    取代 requests 的傳輸層：依 host 回傳錄好的頁面，並加上指定的延遲或故障。
+    """
+    def __init__(self, pages, profiles, latency):
+        super().__init__()
+        self.pages = pages # host -> bytes
+        self.profiles = profiles # host -> Profile
+        self.latency = latency
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        host = urlsplit(request.url).hostname
+        profile = self.profiles.get(host, Profile())
+        latency = (profile.latency if profile.latency is not None else self.latency) * random.uniform(0.8, 1.2)
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+
+        if profile.kind == 'timeout' or (read_timeout and latency > read_timeout):
+            time.sleep(read_timeout or latency)
+            raise requests.exceptions.ReadTimeout(f'replay: {host} 逾時', request=request)
+        time.sleep(latency)
+
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        if profile.kind == 'error':
+            response.status_code = 503
+            response.reason = 'Service Unavailable'
+            response._content = b''
+        elif profile.kind == 'captcha':
+            response._content = CAPTCHA_PAGE
+        else:
+            response._content = self.pages.get(host, b'<html></html>')
+        response.headers = CaseInsensitiveDict({'Content-Type': 'text/html; charset=utf-8'})
+        response.url = request.url
+        response.request = request
+        response.encoding = None
+        response._content_consumed = True # fetch_page 以 iter_content 讀取時直接使用 _content
+        return response
+
+    def close(self):
+        pass
+
+def vendor_host(vendor):
+    return urlsplit(vendor.search_url('x')).hostname
+
+def install_replay(pages_dir, profiles, latency):
+    """把 ReplayAdapter 掛到每個廠商 host 的 Session 上，回傳 {廠商 key: 頁面來源}。"""
+    pages = {}
+    host_profiles = {}
+    sources = {}
+    for vendor in app.enabled_vendors():
+        host = vendor_host(vendor)
+        pages[host], sources[vendor.key] = load_page(vendor, pages_dir)
+        if vendor.key in profiles:
+            host_profiles[host] = profiles[vendor.key]
+    adapter = ReplayAdapter(pages, host_profiles, latency)
+    for host in pages:
+        session, _ = app.get_host_session(host)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    return sources
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def run_timed(func, jobs, concurrency):
+    """以 concurrency 個執行緒跑完 jobs，回傳 (每次耗時 list, 總耗時)。"""
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(job):
+        started = time.perf_counter()
+        func(job)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, jobs))
+    return latencies, time.perf_counter() - started
+
+def report(title, latencies, total_seconds):
+    ordered = sorted(latencies)
+    print(f'{title:<28} n={len(ordered):<5} '
+          f'p50={percentile(ordered, 50) * 1000:8.1f}ms '
+          f'p95={percentile(ordered, 95) * 1000:8.1f}ms '
+          f'p99={percentile(ordered, 99) * 1000:8.1f}ms '
+          f'throughput={len(ordered) / total_seconds:7.2f}/s')
+
+def report_stages():
+    totals = {}
+    for row in app.stage_stats.snapshot():
+        stage = totals.setdefault(row['stage'], [0, 0.0, 0.0])
+        stage[0] += row['count']
+        stage[1] += row['wall_seconds']
+        stage[2] += row['cpu_seconds']
+    print('stage        count   wall/call    cpu/call    cpu total')
+    for name in ('fetch', 'parse', 'extract', 'format'):
+        if name in totals:
+            count, wall, cpu = totals[name]
+            print(f'{name:<10}{count:>8} {wall / count * 1000:9.2f}ms {cpu / count * 1000:9.2f}ms {cpu:10.3f}s')
+
+def command_run(args):
+    if not args.polite:
+        app.rate_limiter.enabled = False
+    if not args.cache:
+        app.lookup_cache.max_entries = 0
+    app.lookup_cache.clear()
+
+    sources = install_replay(args.pages, dict(args.profile), args.latency)
+    parts = DEFAULT_PARTS
+    if args.parts:
+        with open(args.parts, encoding='utf-8') as f:
+            parts = [line.strip() for line in f if line.strip()]
+    jobs = [parts[i % len(parts)] for i in range(args.iterations)]
+
+    print('fixtures: ' + ', '.join(f'{key}={source}' for key, source in sources.items()))
+    print(f'parts={len(parts)} iterations={args.iterations} concurrency={args.concurrency} '
+          f'latency={args.latency}s parser={app.HTML_PARSER} cache={"on" if args.cache else "off"}')
+    if args.tracemalloc:
+        tracemalloc.start()
+    app.stage_stats.reset()
+
+    # 量測期間先關掉其他輸出，結束後再一起輸出報告
+    reports = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {}
+        if 'search' in args.target:
+            def search(part):
+                results[part] = app.search_component_info(part)
+            reports.append(('search_component_info',) + run_timed(search, jobs, args.concurrency))
+
+        if 'scrapers' in args.target:
+            headers = app.build_request_headers()
+            for vendor in app.enabled_vendors():
+                reports.append((f'scrape {vendor.key}',) + run_timed(
+                    lambda part, vendor=vendor: app.run_vendor_scraper(vendor, part, headers),
+                    jobs, args.concurrency))
+
+        if 'format' in args.target:
+            if not results:
+                results = {part: app.search_component_info(part) for part in parts}
+            format_jobs = [results[part] for part in jobs] * 10
+            reports.append(('format_search_results',) + run_timed(app.format_search_results_for_line, format_jobs, 1))
+
+    for title, latencies, total in reports:
+        report(title, latencies, total)
+    report_stages()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'peak RSS: {peak_rss_mb:.1f} MB')
+    if args.tracemalloc:
+        _, peak = tracemalloc.get_traced_memory()
+        print(f'peak Python allocations (tracemalloc): {peak / 1024 / 1024:.1f} MB')
+    print(f'cache: {app.lookup_cache.stats()}')
+
+def command_record(args):
+    os.makedirs(args.out, exist_ok=True)
+    headers = app.build_request_headers()
+    for vendor in app.enabled_vendors():
+        url = vendor.search_url(args.part)
+        try:
+            response = app.fetch_page(url, headers, timeout=vendor.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f'{vendor.key}: 錄製失敗 {e}')
+            continue
+        path = os.path.join(args.out, f'{vendor.key}.html')
+        with open(path, 'wb') as f:
+            f.write(response.content)
+        print(f'{vendor.key}: {len(response.content) // 1024} KB -> {path}')
+
+def _profile_arg(text):
+    key, _, spec = text.partition('=')
+    return key, Profile.parse(spec or 'ok')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record = subparsers.add_parser('record', help='從真實網站錄製各廠商的搜尋結果頁')
+    record.add_argument('part')
+    record.add_argument('--out', default=FIXTURES_DIR)
+
+    run = subparsers.add_parser('run', help='以錄好的頁面重播並量測')
+    run.add_argument('--pages', default=FIXTURES_DIR, help='錄製檔目錄（<廠商 key>.html）')
+    run.add_argument('--parts', help='料號清單檔，一行一個')
+    run.add_argument('--iterations', type=int, default=50)
+    run.add_argument('--concurrency', type=int, default=4)
+    run.add_argument('--latency', type=float, default=0.3, help='每個請求的基本延遲（秒）')
+    run.add_argument('--profile', type=_profile_arg, action='append', default=[],
+                     help='廠商 key=種類[:秒]，可重複指定')
+    run.add_argument('--target', nargs='+', default=['search', 'scrapers', 'format'],
+                     choices=['search', 'scrapers', 'format'])
+    run.add_argument('--cache', action='store_true', help='啟用查詢結果快取')
+    run.add_argument('--polite', action='store_true', help='保留每個 host 的請求頻率限制（token bucket）')
+    run.add_argument('--tracemalloc', action='store_true', help='以 tracemalloc 量測 Python 記憶體高峰（較慢）')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        command_record(args)
+    else:
+        command_run(args)
+
+if __name__ == '__main__':
+    main()
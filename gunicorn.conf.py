@@ -0,0 +1,49 @@
+"""
+gunicorn 設定（Procfile 以 -c gunicorn.conf.py 載入），所有參數都可以用環境變數調整：
+
+    GUNICORN_WORKER_CLASS        gthread（預設）、gevent（需另外 pip install gevent）或 sync
+    WEB_CONCURRENCY              worker process 數（Heroku 會依 dyno 大小自動設定）
+    GUNICORN_THREADS             gthread 每個 worker 同時處理的 HTTP 請求數
+    GUNICORN_WORKER_CONNECTIONS  gevent 每個 worker 同時處理的 HTTP 請求數
+    GUNICORN_TIMEOUT             worker 沒有回應多久就重啟（秒）
+    GUNICORN_MAX_REQUESTS        每個 worker 處理幾個請求後重啟（預設 0，不重啟）
+    LOOKUP_CONCURRENCY           每個 worker 同時進行的料號查詢數
+
+LINE 的查詢在 webhook 回應之後由背景執行緒處理，同時查詢數由 JOB_WORKERS 決定，
+實際的廠商請求由 SEARCH_MAX_WORKERS 個執行緒處理。這裡依 LOOKUP_CONCURRENCY 推算這兩個值的
+預設值（已設定的環境變數優先），同時查詢數只需要調整一個地方。
+查詢大多在等待網站回應，gthread 每個查詢約多佔一個執行緒；
+要在一個 process 內同時處理上百個查詢，可以改用 gevent，或搭配 FETCH_BACKEND=aiohttp
+讓所有連線由一個 event loop 處理。解析頁面仍需要 CPU，受 GIL 限制，
+CPU 吃緊時應增加 WEB_CONCURRENCY 而不是同時查詢數。
+
+以 python -m bench.loadtest 比較不同設定的每秒請求數與每個查詢佔用的記憶體。
+"""
+import importlib.util
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+    print('警告：未安裝 gevent，GUNICORN_WORKER_CLASS 改用 gthread。')
+    worker_class = 'gthread'
+
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# sync worker 設定 threads > 1 時 gunicorn 會自動改用 gthread，所以只有 gthread 使用這個值
+threads = int(os.getenv('GUNICORN_THREADS', '16')) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))
+# gthread/gevent 的 worker 在處理長時間的請求（例如 /bom 串流）時仍會回報存活，這個值不會中斷查詢
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+# 重啟會丟掉背景工作佇列中已回應 200 的 LINE 事件（LINE 不會重送），以及快取、斷路器等狀態，
+# 所以預設不定期重啟；/metrics 的抓取也會計入請求數
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+errorlog = '-'
+
+_DEFAULT_LOOKUP_CONCURRENCY = {'gevent': 200, 'gthread': 16, 'sync': 4}
+lookup_concurrency = int(os.getenv('LOOKUP_CONCURRENCY', str(_DEFAULT_LOOKUP_CONCURRENCY.get(worker_class, 16))))
+# 每個查詢同時查詢所有廠商（預設 5 家）
+os.environ.setdefault('JOB_WORKERS', str(lookup_concurrency))
+os.environ.setdefault('SEARCH_MAX_WORKERS', str(lookup_concurrency * 5))
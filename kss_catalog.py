@@ -0,0 +1,350 @@
+"""
+KSS 型錄（PDF）的離線索引。
+
+    python -m kss_catalog build [--source 網址或檔案路徑] [--index kss_catalog.idx] [--force]
+    python -m kss_catalog lookup CV-100
+
+下載（或讀取本機的）型錄 PDF，擷取料號、說明與規格表，建立依料號排序的二進位索引檔。
+索引檔以 mmap 讀取，每個 worker 開啟時不需要解析也不會複製一份到記憶體，查詢為二分搜尋。
+只有在 PDF 的 ETag 或 sha256 改變時才重新擷取。
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import unicodedata
+
+import requests
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+DEFAULT_SOURCE = "https://www.kss.com.tw/filedown.php?file=catalog.pdf&site=dXBsb2FkL3RlY3Bkb3duLzQ4Ny1DUy5wZGY="
+DEFAULT_INDEX_PATH = 'kss_catalog.idx'
+
+# 索引檔格式（little-endian）：
+#   檔頭   magic(8) | 筆數 uint32 | 來源 PDF 的 sha256(32)
+#   目錄   每筆 (key 位置, key 長度, 資料位置, 資料長度) 各 uint32，依 key 排序
+#   資料   index_key() 的料號（UTF-8）與 JSON 資料依序排列，位置從資料區開頭起算
+MAGIC = b'KSSIDX01'
+HEADER = struct.Struct('<8sI32s')
+ENTRY = struct.Struct('<IIII')
+
+# --- 料號正規化（與 app.normalize_component_name 相同） ---
+_DASHES = re.compile(r'[\u2010-\u2015\u2212]')
+_SEPARATORS = re.compile(r'[\s\-]+')
+
+def normalize_part_number(text):
+    text = unicodedata.normalize('NFKC', text).upper()
+    text = _DASHES.sub('-', text)
+    return _SEPARATORS.sub('-', text).strip('-')
+
+def index_key(component_name):
+    """索引使用的 key：去掉分隔符號，CV-100、cv100、KSS CV 100 都對應到 CV100。"""
+    part = normalize_part_number(component_name)
+    if part.startswith('KSS-'):
+        part = part[4:]
+    return part.replace('-', '').encode('utf-8')
+
+# --- 從 PDF 擷取料號 ---
+# KSS 的料號為英文字母開頭再接數字，例如 CV-100、HPC-1、RNB1.25-3
+_PART_NUMBER = re.compile(r'^[A-Z]{1,6}[- ]?\d[\w./-]*$', re.IGNORECASE)
+# 規格表的標題列（第一欄）
+_TABLE_HEADER = re.compile(r'^(型號|品號|料號|CAT\.?\s*NO\.?|PART\s*NO\.?|ITEM\s*NO\.?|MODEL)', re.IGNORECASE)
+_COLUMNS = re.compile(r'\s{2,}|\t')
+
+def parse_page(text, page_number):
+    """
+    從一頁以版面模式擷取的文字中找出料號列。欄位之間以兩個以上的空白分隔；
+    遇到規格表的標題列時，之後的料號列依標題對應欄位名稱，否則整列當成一個規格欄位。
+    說明使用最近一個不是料號列的短標題（例如「尼龍紮線帶 Cable Ties」）。
+    """
+    entries = []
+    header = None
+    section = ''
+    for line in text.splitlines():
+        columns = [column.strip() for column in _COLUMNS.split(line.strip()) if column.strip()]
+        if not columns or columns[0].isdigit() and len(columns) == 1:
+            continue # 空行或頁碼
+        if _TABLE_HEADER.match(columns[0]):
+            header = columns
+            continue
+        if _PART_NUMBER.match(columns[0]) and len(columns) > 1:
+            values = columns[1:]
+            if header and len(header) == len(columns):
+                specs = dict(zip(header[1:], values))
+            else:
+                specs = {"規格": " ".join(values)}
+            entries.append({"part": columns[0], "description": section, "specs": specs, "page": page_number})
+            continue
+        if len(line.strip()) <= 40:
+            section = " ".join(columns)
+            header = None
+    return entries
+
+def extract_entries(pdf_path):
+    """擷取整份型錄，回傳 list of {part, description, specs, page}。"""
+    if PdfReader is None:
+        raise RuntimeError('需要安裝 pypdf 才能擷取 KSS 型錄（pip install pypdf）')
+    reader = PdfReader(pdf_path)
+    entries = []
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text(extraction_mode='layout')
+        except Exception:
+            text = page.extract_text() or ''
+        entries.extend(parse_page(text, page_number))
+    return entries
+
+# --- 索引檔 ---
+def write_index(entries, index_path, source_sha256):
+    """依正規化料號排序後寫入索引檔（先寫暫存檔再取代，讀取中的 worker 不受影響）。重複的料號保留第一筆。"""
+    records = {}
+    for entry in entries:
+        key = index_key(entry["part"])
+        if key and key not in records:
+            records[key] = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    keys = sorted(records)
+
+    table = bytearray()
+    data = bytearray()
+    for key in keys:
+        record = records[key]
+        table += ENTRY.pack(len(data), len(key), len(data) + len(key), len(record))
+        data += key + record
+
+    directory = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.kss-', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(keys), bytes.fromhex(source_sha256)))
+        f.write(table)
+        f.write(data)
+    os.replace(tmp_path, index_path)
+    return len(keys)
+
+class _Keys:
+    """讓 bisect 可以直接在 mmap 上二分搜尋 key。"""
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def __getitem__(self, i):
+        return self._snapshot.key(i)
+
+class _Snapshot:
+    """
+    某一個版本的索引檔（mmap 與標頭資訊），建立後不再修改。
+    重新開啟時整個換成新的 _Snapshot，讀取中的執行緒繼續使用手上的舊版本，不會讀到新舊混合的資料。
+    """
+    __slots__ = ('mm', 'stat', 'count', 'source_sha256', 'data_offset')
+
+    def __init__(self, mm=None, stat=None, count=0, source_sha256=None):
+        self.mm = mm
+        self.stat = stat
+        self.count = count
+        self.source_sha256 = source_sha256
+        self.data_offset = HEADER.size + count * ENTRY.size
+
+    def entry(self, i):
+        return ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+
+    def key(self, i):
+        key_offset, key_length, _, _ = self.entry(i)
+        start = self.data_offset + key_offset
+        return self.mm[start:start + key_length]
+
+    def record(self, i):
+        _, _, record_offset, record_length = self.entry(i)
+        start = self.data_offset + record_offset
+        return json.loads(self.mm[start:start + record_length])
+
+_EMPTY = _Snapshot()
+
+class CatalogIndex:
+    """
+    以 mmap 開啟索引檔。檔案不存在時視為空的索引；索引建立或重建（檔案被取代）後，
+    lookup 與 len() 會在最多 check_interval 秒內自動重新開啟，重建的一方可以呼叫 reload() 立即生效。
+    """
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = _EMPTY
+        self._checked_at = 0.0
+        self._open()
+
+    @property
+    def count(self):
+        return self._snapshot.count
+
+    @property
+    def source_sha256(self):
+        return self._snapshot.source_sha256
+
+    def _open(self):
+        try:
+            stat = os.stat(self.path)
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._snapshot = _EMPTY
+            return
+        try:
+            magic, count, sha256 = HEADER.unpack_from(mm, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            mm.close()
+            self._snapshot = _EMPTY
+            return
+        # 只有這一次賦值，其他執行緒看到的不是舊版本就是完整的新版本
+        self._snapshot = _Snapshot(mm, (stat.st_ino, stat.st_mtime_ns), count, sha256.hex())
+
+    def _reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            current = None
+        if current != self._snapshot.stat:
+            self._open() # 舊的 mmap 留給 GC 關閉，其他執行緒可能還在讀取
+
+    def reload(self):
+        """檔案有變更時立即重新開啟（不等 check_interval）。"""
+        self._reload_if_changed(force=True)
+
+    def lookup(self, component_name, limit=3):
+        """完全相同的料號只回傳那一筆，否則回傳開頭相同的前 limit 筆（至少要 3 個字元）。"""
+        self._reload_if_changed()
+        snapshot = self._snapshot
+        if not snapshot.count:
+            return []
+        key = index_key(component_name)
+        if len(key) < 3:
+            return []
+        keys = _Keys(snapshot)
+        i = bisect.bisect_left(keys, key)
+        if i < snapshot.count and keys[i] == key:
+            return [snapshot.record(i)]
+        results = []
+        while i < snapshot.count and len(results) < limit and keys[i].startswith(key):
+            results.append(snapshot.record(i))
+            i += 1
+        return results
+
+    def __len__(self):
+        self._reload_if_changed()
+        return self.count
+
+# --- 下載與重建 ---
+def _meta_path(index_path):
+    return index_path + '.json'
+
+def _load_meta(index_path):
+    try:
+        with open(_meta_path(index_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_meta(index_path, meta):
+    tmp_path = f"{_meta_path(index_path)}.{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, _meta_path(index_path))
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _download(url, etag, timeout):
+    """回傳 (暫存檔路徑, ETag)；伺服器回應 304（ETag 沒變）時回傳 (None, etag)。"""
+    headers = {'User-Agent': 'Mozilla/5.0 (compatible; spider-code KSS catalog)'}
+    if etag:
+        headers['If-None-Match'] = etag
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        fd, tmp_path = tempfile.mkstemp(prefix='kss-', suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.iter_content(1 << 16):
+                f.write(chunk)
+        return tmp_path, response.headers.get('ETag')
+
+def ensure_index(source=DEFAULT_SOURCE, index_path=DEFAULT_INDEX_PATH, force=False, timeout=60):
+    """
+    確認索引是最新的，回傳 (是否重建, 筆數)。source 為網址時以 ETag 詢問是否有更新，
+    下載後（或本機檔案）再以 sha256 比對，內容沒變就不重新擷取。
+    """
+    meta = _load_meta(index_path)
+    index_exists = os.path.exists(index_path)
+    is_url = source.startswith(('http://', 'https://'))
+    if is_url:
+        pdf_path, etag = _download(source, None if force or not index_exists else meta.get('etag'), timeout)
+        if pdf_path is None:
+            return False, meta.get('entries', 0)
+    else:
+        pdf_path, etag = source, None
+
+    try:
+        sha256 = _sha256_file(pdf_path)
+        if not force and index_exists and sha256 == meta.get('sha256'):
+            if etag != meta.get('etag'):
+                _save_meta(index_path, dict(meta, etag=etag))
+            return False, meta.get('entries', 0)
+        count = write_index(extract_entries(pdf_path), index_path, sha256)
+    finally:
+        if is_url:
+            os.remove(pdf_path)
+    _save_meta(index_path, {
+        "source": source,
+        "etag": etag,
+        "sha256": sha256,
+        "entries": count,
+        "built_at": time.time(),
+    })
+    return True, count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='下載/讀取型錄並建立索引（內容沒變時略過）')
+    build.add_argument('--source', default=os.getenv('KSS_CATALOG_SOURCE', DEFAULT_SOURCE))
+    build.add_argument('--index', default=os.getenv('KSS_CATALOG_INDEX', DEFAULT_INDEX_PATH))
+    build.add_argument('--force', action='store_true', help='不論內容是否改變都重新擷取')
+    lookup = subparsers.add_parser('lookup', help='查詢索引')
+    lookup.add_argument('part')
+    lookup.add_argument('--index', default=os.getenv('KSS_CATALOG_INDEX', DEFAULT_INDEX_PATH))
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        rebuilt, count = ensure_index(args.source, args.index, force=args.force)
+        print(f"{'已重建' if rebuilt else '型錄沒有變更，略過'}：{count} 個料號 -> {args.index}")
+    else:
+        index = CatalogIndex(args.index)
+        started = time.perf_counter()
+        results = index.lookup(args.part)
+        elapsed = (time.perf_counter() - started) * 1e6
+        for entry in results:
+            print(json.dumps(entry, ensure_ascii=False))
+        print(f"{len(results)} 筆（共 {len(index)} 個料號，{elapsed:.0f} µs）")
+
+if __name__ == '__main__':
+    main()